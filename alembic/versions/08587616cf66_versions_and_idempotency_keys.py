@@ -0,0 +1,44 @@
+"""Versions and idempotency keys
+
+Revision ID: 08587616cf66
+Revises: 58c91edee555
+Create Date: 2026-10-18 16:21:37.418905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '08587616cf66'
+down_revision: Union[str, Sequence[str], None] = '58c91edee555'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in ('collections', 'products'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    op.create_table('idempotency_keys',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('request', sa.String(length=300), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('media_type', sa.String(length=100), nullable=True),
+    sa.Column('body', sa.LargeBinary(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('idempotency_keys')
+
+    for table in ('products', 'collections'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
@@ -0,0 +1,43 @@
+"""Cascade product collection delete
+
+Revision ID: 5ddd1196215c
+Revises: 6add0c4bd2df
+Create Date: 2026-10-18 13:40:52.118063
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5ddd1196215c'
+down_revision: Union[str, Sequence[str], None] = '6add0c4bd2df'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.drop_constraint('products_collection_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key(
+            'products_collection_id_fkey',
+            'collections',
+            ['collection_id'],
+            ['id'],
+            ondelete='CASCADE',
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.drop_constraint('products_collection_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key(
+            'products_collection_id_fkey',
+            'collections',
+            ['collection_id'],
+            ['id'],
+        )
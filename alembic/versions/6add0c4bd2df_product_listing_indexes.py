@@ -0,0 +1,34 @@
+"""Product listing indexes
+
+Revision ID: 6add0c4bd2df
+Revises: 6e944e6399d2
+Create Date: 2026-10-18 11:03:17.582930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6add0c4bd2df'
+down_revision: Union[str, Sequence[str], None] = '6e944e6399d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_products_collection_id_id', 'products', ['collection_id', 'id'], unique=False)
+    op.create_index('ix_products_collection_id_price_id', 'products', ['collection_id', 'price', 'id'], unique=False)
+    op.create_index('ix_products_menu_price_id', 'products', ['menu', 'price', 'id'], unique=False)
+    op.create_index('ix_products_price_id', 'products', ['price', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_price_id', table_name='products')
+    op.drop_index('ix_products_menu_price_id', table_name='products')
+    op.drop_index('ix_products_collection_id_price_id', table_name='products')
+    op.drop_index('ix_products_collection_id_id', table_name='products')
@@ -0,0 +1,37 @@
+"""Product search index
+
+Revision ID: 6e944e6399d2
+Revises: 06babda4900d
+Create Date: 2026-10-18 10:12:41.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6e944e6399d2'
+down_revision: Union[str, Sequence[str], None] = '06babda4900d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the expression must stay identical to search.search_document()
+    # or the planner will not use the index
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index(
+            'ix_products_search',
+            'products',
+            [sa.text("to_tsvector('simple'::regconfig, title || ' ' || description)")],
+            postgresql_using='gin',
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_products_search', table_name='products')
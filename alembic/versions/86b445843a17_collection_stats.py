@@ -0,0 +1,53 @@
+"""Collection stats
+
+Revision ID: 86b445843a17
+Revises: 5ddd1196215c
+Create Date: 2026-10-18 14:22:09.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '86b445843a17'
+down_revision: Union[str, Sequence[str], None] = '5ddd1196215c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('collection_stats',
+    sa.Column('collection_id', sa.BigInteger(), nullable=False),
+    sa.Column('product_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('casual_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('special_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('min_price', sa.DECIMAL(precision=10, scale=0), nullable=True),
+    sa.Column('max_price', sa.DECIMAL(precision=10, scale=0), nullable=True),
+    sa.ForeignKeyConstraint(['collection_id'], ['collections.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('collection_id')
+    )
+    op.execute(
+        """
+        INSERT INTO collection_stats
+            (collection_id, product_count, casual_count, special_count,
+             min_price, max_price)
+        SELECT collections.id,
+               count(products.id),
+               sum(CASE WHEN products.menu = 'casual' THEN 1 ELSE 0 END),
+               sum(CASE WHEN products.menu = 'special' THEN 1 ELSE 0 END),
+               min(products.price),
+               max(products.price)
+        FROM collections
+        LEFT OUTER JOIN products ON products.collection_id = collections.id
+        GROUP BY collections.id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('collection_stats')
@@ -0,0 +1,43 @@
+"""Catalog updated_at
+
+Revision ID: dbe71fce8c0d
+Revises: 86b445843a17
+Create Date: 2026-10-18 15:08:41.377520
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'dbe71fce8c0d'
+down_revision: Union[str, Sequence[str], None] = '86b445843a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite cannot add a column with a non-constant default, so the column is
+    # added nullable, backfilled, then tightened
+    for table in ('collections', 'products'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+        op.execute(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP')
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now())
+
+    op.create_index('ix_products_updated_at_id', 'products', ['updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_updated_at_id', table_name='products')
+
+    for table in ('products', 'collections'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
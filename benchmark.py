@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import datetime
+import tempfile
+import shutil
+import random
+import json
+import time
+import sys
+import io
+import os
+
+parser = argparse.ArgumentParser(description="load test the catalog api in-process")
+parser.add_argument("--database-url", help="sync url, defaults to a temp sqlite file")
+parser.add_argument("--collections", type=int, default=20)
+parser.add_argument("--products", type=int, default=5000)
+parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--per-page", type=int, default=16)
+parser.add_argument("--cache", default="none", help="CACHE_BACKEND for the run")
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument(
+    "--admission",
+    action="store_true",
+    help="keep rate limits and load shedding on, shed requests count as errors",
+)
+parser.add_argument(
+    "--reset",
+    action="store_true",
+    help="drop and reseed a --database-url that already holds catalog data",
+)
+parser.add_argument("--output", help="write the json results to this file")
+parser.add_argument("--compare", help="previous results file to diff against")
+args = parser.parse_args()
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+start_dir = os.getcwd()
+work_dir = tempfile.mkdtemp(prefix="fast-shop-bench-")
+database_url = args.database_url or f"sqlite:///{work_dir}/bench.db"
+
+# configuration is read at import time, so it has to be in place first
+os.environ["DATABASE_URL"] = database_url
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["READ_REPLICA_URLS"] = ""
+os.environ["CACHE_BACKEND"] = args.cache
+os.environ["DB_ECHO"] = "false"
+# every request comes from one client, which a per-client limit would throttle
+os.environ["RATE_LIMIT_BACKEND"] = "memory" if args.admission else "none"
+os.environ["ADMISSION_CONTROL"] = "true" if args.admission else "false"
+sys.path.insert(0, repo_dir)
+os.chdir(work_dir)
+
+import httpx  # noqa: E402
+from sqlalchemy import inspect, insert, select, func  # noqa: E402
+from database import engin, db_base  # noqa: E402
+from models import Collection, CollectionStats, Product  # noqa: E402
+from pagination import encode_cursor  # noqa: E402
+import metrics  # noqa: E402
+import main  # noqa: E402
+from lifecycle import lifespan  # noqa: E402
+
+
+def sample_image():
+    try:
+        from PIL import Image
+    except ImportError:
+        return os.urandom(2048)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 80, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def holds_data():
+    existing = set(inspect(engin).get_table_names())
+
+    with engin.connect() as connection:
+        return any(
+            connection.scalar(select(func.count()).select_from(table))
+            for table in db_base.metadata.sorted_tables
+            if table.name in existing
+        )
+
+
+def seed():
+    # seeding drops every table, so a database that is not ours is left alone
+    if not args.reset and holds_data():
+        sys.exit(
+            f"{engin.url.render_as_string()} already holds catalog data, "
+            "pass --reset to drop it and seed the benchmark data"
+        )
+
+    db_base.metadata.drop_all(engin)
+    db_base.metadata.create_all(engin)
+
+    collections = [
+        {"id": i, "title": f"collection{i}"} for i in range(1, args.collections + 1)
+    ]
+    products = [
+        {
+            "id": i,
+            "title": f"product{i}",
+            "price": random.randint(1, 100000),
+            "description": "seeded product " * 20,
+            "image_path": "",
+            "menu": random.choice(["casual", "special"]),
+            "collection_id": random.randint(1, args.collections),
+        }
+        for i in range(1, args.products + 1)
+    ]
+
+    stats = {
+        collection["id"]: {
+            "collection_id": collection["id"],
+            "product_count": 0,
+            "casual_count": 0,
+            "special_count": 0,
+            "min_price": None,
+            "max_price": None,
+        }
+        for collection in collections
+    }
+
+    for product in products:
+        row = stats[product["collection_id"]]
+        row["product_count"] += 1
+        row[f"{product['menu']}_count"] += 1
+        row["min_price"] = min(row["min_price"] or product["price"], product["price"])
+        row["max_price"] = max(row["max_price"] or product["price"], product["price"])
+
+    with engin.begin() as connection:
+        connection.execute(insert(Collection), collections)
+        connection.execute(insert(CollectionStats), list(stats.values()))
+
+        for start in range(0, len(products), 5000):
+            connection.execute(insert(Product), products[start : start + 5000])
+
+
+def percentile(values: list, fraction: float):
+    index = max(0, min(len(values) - 1, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def scenarios(image: bytes):
+    last_page = max(1, args.products // args.per_page)
+    deep_cursor = encode_cursor(max(0, args.products - 2 * args.per_page))
+    run_id = int(time.time())
+
+    def get_product(i):
+        return ("GET", f"/get-product/{random.randint(1, args.products)}", {})
+
+    def list_shallow(i):
+        return ("GET", f"/get-all-products?per_page={args.per_page}", {})
+
+    def list_deep_offset(i):
+        url = f"/get-all-products?per_page={args.per_page}&page={last_page}"
+        return ("GET", url, {})
+
+    def list_deep_cursor(i):
+        url = f"/get-all-products?per_page={args.per_page}&after={deep_cursor}"
+        return ("GET", url, {})
+
+    def create_product(i):
+        data = {
+            "title": f"bench{run_id}x{i}",
+            "price": random.randint(1, 100000),
+            "description": "benchmark product",
+            "menu": "casual",
+            "collection_id": random.randint(1, args.collections),
+        }
+        files = {"product_image": (f"bench{i}.png", image, "image/png")}
+        return ("POST", "/create-product", {"data": data, "files": files})
+
+    def update_product(i):
+        url = f"/update-product/{random.randint(1, args.products)}"
+        return ("PATCH", url, {"data": {"price": random.randint(1, 100000)}})
+
+    def update_collection(i):
+        url = f"/update-collection/{random.randint(1, args.collections)}"
+        return ("PATCH", url, {"data": {"title": f"renamed{run_id}x{i}"}})
+
+    return {
+        "get_product": get_product,
+        "list_shallow": list_shallow,
+        "list_deep_offset": list_deep_offset,
+        "list_deep_cursor": list_deep_cursor,
+        "create_product": create_product,
+        "update_product": update_product,
+        "update_collection": update_collection,
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, build_request):
+    latencies = []
+    errors = 0
+    counter = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+
+        for i in counter:
+            method, url, options = build_request(i)
+            started = time.perf_counter()
+            response = await client.request(method, url, **options)
+            latencies.append(time.perf_counter() - started)
+
+            if response.status_code >= 400 or "error" in response.text[:20]:
+                errors += 1
+
+    queries_before = metrics.db_queries.values[()]
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+    queries = metrics.db_queries.values[()] - queries_before
+
+    latencies.sort()
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_request": round(queries / len(latencies), 2),
+    }
+
+
+async def run():
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+    async with lifespan(main.app), client:
+        for name, build_request in scenarios(sample_image()).items():
+            results[name] = await run_scenario(client, build_request)
+            print(
+                f"{name:<20} {results[name]['throughput_rps']:>9} req/s"
+                f"  p50 {results[name]['p50_ms']:>8} ms"
+                f"  p95 {results[name]['p95_ms']:>8} ms"
+                f"  p99 {results[name]['p99_ms']:>8} ms"
+                f"  {results[name]['queries_per_request']:>5} q/req"
+                f"  {results[name]['errors']} errors",
+                file=sys.stderr,
+            )
+
+    return results
+
+
+def compare(results: dict, previous: dict):
+    for name, current in results.items():
+        before = previous.get(name)
+
+        if before is None:
+            continue
+
+        p95 = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rps = current["throughput_rps"] - before["throughput_rps"]
+        rps = rps / before["throughput_rps"] * 100
+        print(f"{name:<20} p95 {p95:+7.1f}%  throughput {rps:+7.1f}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    random.seed(args.seed)
+    seed()
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "database": engin.dialect.name,
+        "settings": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare", "database_url")
+        },
+        "results": asyncio.run(run()),
+    }
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.compare:
+        with open(os.path.join(start_dir, args.compare)) as file:
+            compare(report["results"], json.load(file)["results"])
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(os.path.join(start_dir, args.output), "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,233 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+from urllib.parse import urlencode
+from responses import dumps
+import asyncio
+import json
+import time
+import os
+
+load_dotenv()
+
+
+class BaseCache:
+    backend = "base"
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, value):
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def stats(self):
+        return {"backend": self.backend, "hits": self.hits, "misses": self.misses}
+
+    async def get_many(self, keys: list):
+        return [await self.get(key) for key in keys]
+
+    async def set_many(self, items: dict, ttl: int = None):
+        for key, value in items.items():
+            await self.set(key, value, ttl)
+
+    async def close(self):
+        pass
+
+
+class NullCache(BaseCache):
+    backend = "none"
+
+    async def get(self, key: str):
+        return self.count(None)
+
+    async def set(self, key: str, value, ttl: int = None):
+        pass
+
+    async def delete(self, *keys: str):
+        pass
+
+    async def incr(self, key: str):
+        return 0
+
+    async def counter(self, key: str):
+        return 0
+
+
+class MemoryCache(BaseCache):
+    backend = "memory"
+
+    def __init__(self, ttl: int, max_entries: int):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # generation counters live outside the LRU so eviction can never
+        # roll one back and resurrect an older generation's entries
+        self.counters = {}
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] < time.monotonic():
+            del self.entries[key]
+            entry = None
+
+        if entry is None:
+            return self.count(None)
+
+        self.entries.move_to_end(key)
+        return self.count(entry[1])
+
+    async def set(self, key: str, value, ttl: int = None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def incr(self, key: str):
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return self.counters[key]
+
+    async def counter(self, key: str):
+        return self.counters.get(key, 0)
+
+    def stats(self):
+        return {**super().stats(), "entries": len(self.entries)}
+
+
+class RedisCache(BaseCache):
+    """Works with any client exposing the redis.asyncio get/set/delete/incr API."""
+
+    backend = "redis"
+
+    def __init__(self, client, ttl: int, prefix: str = "fast-shop:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        return self.count(None if raw is None else json.loads(raw))
+
+    async def set(self, key: str, value, ttl: int = None):
+        raw = dumps(value)
+        await self.client.set(self.prefix + key, raw, ex=ttl or self.ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*[self.prefix + key for key in keys])
+
+    async def incr(self, key: str):
+        return await self.client.incr(self.prefix + key)
+
+    async def counter(self, key: str):
+        return int(await self.client.get(self.prefix + key) or 0)
+
+    async def get_many(self, keys: list):
+        if not keys:
+            return []
+
+        raws = await self.client.mget([self.prefix + key for key in keys])
+        return [self.count(None if raw is None else json.loads(raw)) for raw in raws]
+
+    async def set_many(self, items: dict, ttl: int = None):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(self.prefix + key, dumps(value), ex=ttl or self.ttl)
+
+            await pipe.execute()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def build_cache():
+    backend = os.getenv("CACHE_BACKEND", "memory")
+    ttl = int(os.getenv("CACHE_TTL", "60"))
+
+    if backend == "none":
+        return NullCache(ttl)
+
+    if backend == "redis":
+        import redis.asyncio
+
+        client = redis.asyncio.from_url(os.getenv("CACHE_URL", "redis://localhost"))
+        return RedisCache(client, ttl)
+
+    return MemoryCache(ttl, int(os.getenv("CACHE_MAX_ENTRIES", "1024")))
+
+
+cache = build_cache()
+# set by replicas.py, which knows how long reads may lag behind writes
+repeat_invalidation_seconds = 0
+pending_invalidations = set()
+
+
+def use_cache(backend: BaseCache):
+    global cache
+    cache = backend
+
+
+def cache_stats():
+    return cache.stats()
+
+
+async def close_cache():
+    await cache.close()
+
+
+async def cache_get(key: str):
+    return await cache.get(key)
+
+
+async def cache_set(key: str, value):
+    await cache.set(key, value)
+
+
+async def cache_get_many(keys: list):
+    return await cache.get_many(keys)
+
+
+async def cache_set_many(items: dict):
+    if items:
+        await cache.set_many(items)
+
+
+async def list_key(namespace: str, **params):
+    generation = await cache.counter(f"{namespace}:generation")
+    params = {key: value for key, value in params.items() if value is not None}
+    return f"{namespace}:{generation}:{urlencode(sorted(params.items()))}"
+
+
+async def drop_entries(keys: tuple, lists: tuple):
+    await cache.delete(*keys)
+
+    for namespace in lists:
+        await cache.incr(f"{namespace}:generation")
+
+
+async def drop_entries_later(keys: tuple, lists: tuple):
+    await asyncio.sleep(repeat_invalidation_seconds)
+    await drop_entries(keys, lists)
+
+
+async def invalidate(*keys: str, lists: tuple = ()):
+    await drop_entries(keys, lists)
+
+    if repeat_invalidation_seconds:
+        # a lagging replica can hand the old row to the next reader, who puts
+        # it straight back into the cache; drop it again once replicas caught up
+        task = asyncio.create_task(drop_entries_later(keys, lists))
+        pending_invalidations.add(task)
+        task.add_done_callback(pending_invalidations.discard)
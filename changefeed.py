@@ -0,0 +1,144 @@
+from sqlalchemy import select, insert, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import replica_session
+from models import CatalogChange, Collection, Product
+from export import as_utc
+from responses import dumps
+from dotenv import load_dotenv
+from collections import OrderedDict
+import asyncio
+import time
+import os
+
+load_dotenv()
+
+change_poll_seconds = float(os.getenv("CHANGE_POLL_SECONDS", "1"))
+change_heartbeat_seconds = float(os.getenv("CHANGE_HEARTBEAT_SECONDS", "15"))
+# how long a missing sequence number may still belong to an open transaction
+change_gap_seconds = float(os.getenv("CHANGE_GAP_SECONDS", "5"))
+
+entity_models = {"collection": Collection, "product": Product}
+
+# first missing sequence number of each hole, mapped to when it was noticed
+first_seen_gaps = OrderedDict()
+max_tracked_gaps = 10000
+
+
+def change_rows(entity: str, action: str, entity_ids):
+    return [
+        {"entity": entity, "entity_id": entity_id, "action": action}
+        for entity_id in entity_ids
+    ]
+
+
+async def record_changes(db: AsyncSession, rows: list):
+    if rows:
+        await db.execute(insert(CatalogChange), rows)
+
+
+async def record_changes_where(db: AsyncSession, entity: str, action: str, where):
+    # set-based variant for renames and imports, where the ids are not loaded
+    model = entity_models[entity]
+
+    await db.execute(
+        insert(CatalogChange).from_select(
+            ["entity", "entity_id", "action"],
+            select(literal(entity), model.id, literal(action)).where(where),
+        )
+    )
+
+
+def change_to_dict(change: CatalogChange):
+    return {
+        "seq": change.id,
+        "entity": change.entity,
+        "entity_id": change.entity_id,
+        "action": change.action,
+        "changed_at": as_utc(change.changed_at).isoformat(),
+    }
+
+
+def gap_settled(first_missing: int):
+    # a row's own timestamp says nothing about when it became visible, since
+    # a long transaction commits rows that already look old; so a hole is
+    # aged from the moment this process first noticed it instead
+    now = time.monotonic()
+    seen_at = first_seen_gaps.setdefault(first_missing, now)
+    first_seen_gaps.move_to_end(first_missing)
+
+    while len(first_seen_gaps) > max_tracked_gaps:
+        first_seen_gaps.popitem(last=False)
+
+    return now - seen_at >= change_gap_seconds
+
+
+def settled_changes(changes: list, after: int):
+    # sequence numbers are handed out before commit, so a hole may still be
+    # filled by a slower transaction; stop there until it is old enough to
+    # have been rolled back, otherwise a resuming reader would skip it forever
+    expected = after + 1
+    settled = []
+
+    for change in changes:
+        if change.id != expected and not gap_settled(expected):
+            break
+
+        settled.append(change)
+        expected = change.id + 1
+
+    return settled
+
+
+async def read_changes(db: AsyncSession, after: int, limit: int):
+    result = await db.execute(
+        select(CatalogChange)
+        .where(CatalogChange.id > after)
+        .order_by(CatalogChange.id.asc())
+        .limit(limit)
+    )
+    changes = settled_changes(result.scalars().all(), after)
+
+    return [change_to_dict(change) for change in changes]
+
+
+async def wait_for_changes(db: AsyncSession, after: int, limit: int, wait: float):
+    deadline = time.monotonic() + wait
+
+    while True:
+        changes = await read_changes(db, after, limit)
+
+        if changes or time.monotonic() >= deadline:
+            return changes
+
+        # drop the snapshot so the next poll sees newly committed rows
+        await db.rollback()
+        await asyncio.sleep(min(change_poll_seconds, deadline - time.monotonic()))
+
+
+def sse_event(change: dict):
+    data = dumps(change).decode("utf-8")
+    return f"id: {change['seq']}\nevent: change\ndata: {data}\n\n"
+
+
+async def stream_changes(after: int, limit: int):
+    yield f"retry: {int(change_poll_seconds * 1000)}\n\n"
+    last_sent = time.monotonic()
+
+    while True:
+        async with replica_session() as db:
+            changes = await read_changes(db, after, limit)
+
+        for change in changes:
+            yield sse_event(change)
+            after = change["seq"]
+
+        if changes:
+            last_sent = time.monotonic()
+            continue
+
+        if time.monotonic() - last_sent >= change_heartbeat_seconds:
+            # keeps proxies from closing an idle stream
+            yield ": ping\n\n"
+            last_sent = time.monotonic()
+
+        await asyncio.sleep(change_poll_seconds)
@@ -1,13 +1,110 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
+import itertools
+import time
 import os
 
 load_dotenv()
 
+async_drivers = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # called with the seconds each checkout spent waiting for a connection
+    wait_listeners = []
+
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - started
+
+        for listener in self.wait_listeners:
+            listener(waited)
+
+        return connection
+
+
+def make_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=async_drivers.get(url.drivername, url.drivername))
+
+
 database_url = os.getenv("DATABASE_URL")
+async_database_url = os.getenv("ASYNC_DATABASE_URL") or make_async_url(database_url)
+
+pool_settings = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+}
+echo = os.getenv("DB_ECHO", "false").lower() == "true"
 
-engin = create_engine(database_url, echo=True)
+engin = create_engine(database_url, echo=echo)
 local_session = sessionmaker(bind=engin, autoflush=False)
 
+async_engin = create_async_engine(
+    async_database_url,
+    echo=echo,
+    poolclass=TimedQueuePool,
+    **pool_settings,
+)
+async_local_session = async_sessionmaker(
+    bind=async_engin,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+# comma separated; reads fall back to the primary when none are configured
+replica_urls = [
+    url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+replica_engins = [
+    create_async_engine(
+        make_async_url(url),
+        echo=echo,
+        poolclass=TimedQueuePool,
+        **pool_settings,
+    )
+    for url in replica_urls
+]
+replica_sessions = itertools.cycle(
+    [
+        async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        for engine in replica_engins
+    ]
+    or [async_local_session]
+)
+all_async_engins = [async_engin, *replica_engins]
+
+
+def replica_session():
+    return next(replica_sessions)()
+
+
+def enable_sqlite_foreign_keys(engine):
+    # SQLite ignores ON DELETE CASCADE unless each connection opts in
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+for engine in (engin, *[engine.sync_engine for engine in all_async_engins]):
+    if engine.dialect.name == "sqlite":
+        enable_sqlite_foreign_keys(engine)
+
 db_base = declarative_base()
@@ -1,4 +1,6 @@
-from database import local_session
+from fastapi import Request
+from database import local_session, async_local_session, replica_session
+from replicas import reads_from_primary
 from contextlib import contextmanager
 
 
@@ -21,3 +23,18 @@ def get_db_python():
 
     finally:
         db.close()
+
+
+async def get_db():
+    async with async_local_session() as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    if reads_from_primary(request):
+        session = async_local_session()
+    else:
+        session = replica_session()
+
+    async with session as db:
+        yield db
@@ -0,0 +1,112 @@
+from sqlalchemy import select, literal
+from database import replica_session
+from models import Collection, Product
+from responses import dumps
+from dotenv import load_dotenv
+from datetime import datetime, timezone, timedelta
+import csv
+import io
+import os
+
+load_dotenv()
+
+export_batch_size = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# updated_at is stamped when a transaction starts on Postgres, so a long write
+# can commit rows older than a consumer's last watermark; re-sending this much
+# history covers any transaction shorter than it
+export_overlap = timedelta(seconds=float(os.getenv("EXPORT_OVERLAP_SECONDS", "60")))
+
+export_columns = (
+    Product.id,
+    Product.title,
+    Product.price,
+    Product.description,
+    Product.menu,
+    Product.collection_id,
+    Collection.title.label("collection_title"),
+    Product.image_path,
+    Product.updated_at,
+)
+csv_header = [column.key for column in export_columns]
+
+media_types = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def as_utc(value: datetime):
+    # SQLite hands back naive timestamps, which are UTC by construction
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc)
+
+
+def since_bound(updated_since: datetime, dialect: str):
+    since = as_utc(updated_since) - export_overlap
+
+    if dialect == "sqlite":
+        # SQLite keeps CURRENT_TIMESTAMP as "YYYY-MM-DD HH:MM:SS" text and
+        # compares it as a string, so the bound has to have the same shape
+        return literal(since.strftime("%Y-%m-%d %H:%M:%S"))
+
+    return since
+
+
+def export_query(updated_since: datetime = None, dialect: str = None):
+    query = select(*export_columns).join(
+        Collection, Product.collection_id == Collection.id
+    )
+
+    if updated_since is not None:
+        query = query.where(Product.updated_at >= since_bound(updated_since, dialect))
+
+    return query.order_by(Product.updated_at.asc(), Product.id.asc())
+
+
+def export_row(row):
+    product = row._asdict()
+    product["price"] = int(product["price"])
+    product["menu"] = product["menu"].value
+    product["updated_at"] = as_utc(product["updated_at"]).isoformat()
+
+    return product
+
+
+def encode_ndjson(products: list):
+    return b"".join(dumps(product) + b"\n" for product in products)
+
+
+def encode_csv(products: list, header: bool = False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=csv_header)
+
+    if header:
+        writer.writeheader()
+
+    writer.writerows(products)
+
+    return buffer.getvalue().encode("utf-8")
+
+
+async def export_products(file_format: str, updated_since: datetime = None):
+    # the session lives inside the generator so it stays open while streaming,
+    # and yield_per keeps only one batch of rows in memory at a time
+    async with replica_session() as db:
+        result = await db.stream(
+            export_query(updated_since, db.bind.dialect.name).execution_options(
+                yield_per=export_batch_size
+            )
+        )
+        first = True
+
+        async for partition in result.partitions():
+            products = [export_row(row) for row in partition]
+
+            if file_format == "csv":
+                yield encode_csv(products, header=first)
+            else:
+                yield encode_ndjson(products)
+
+            first = False
+
+        if first and file_format == "csv":
+            yield encode_csv([], header=True)
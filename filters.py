@@ -0,0 +1,68 @@
+from sqlalchemy import tuple_
+from models import Product
+
+sort_columns = {"id": Product.id, "price": Product.price, "title": Product.title}
+cursor_types = {"id": int, "price": int, "title": str}
+
+
+def filter_products(
+    query,
+    menu: str = None,
+    collection_id: int = None,
+    min_price: int = None,
+    max_price: int = None,
+):
+    if menu is not None:
+        query = query.where(Product.menu == menu)
+
+    if collection_id is not None:
+        query = query.where(Product.collection_id == collection_id)
+
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+
+    return query
+
+
+def sort_keys(sort_by: str):
+    # id breaks ties so every sort is a total order and can be seeked
+    if sort_by == "id":
+        return [Product.id]
+
+    return [sort_columns[sort_by], Product.id]
+
+
+def sort_products(query, sort_by: str, order: str):
+    keys = sort_keys(sort_by)
+
+    if order == "desc":
+        return query.order_by(*[key.desc() for key in keys])
+
+    return query.order_by(*[key.asc() for key in keys])
+
+
+def seek_products(query, sort_by: str, order: str, values: list):
+    keys = sort_keys(sort_by)
+    types = [cursor_types[sort_by], int][: len(keys)]
+    values = [cast(value) for cast, value in zip(types, values)]
+
+    if len(keys) == 1:
+        left, right = keys[0], values[0]
+    else:
+        left, right = tuple_(*keys), tuple_(*values)
+
+    if order == "desc":
+        return query.where(left < right)
+
+    return query.where(left > right)
+
+
+def cursor_values(product: Product, sort_by: str):
+    if sort_by == "id":
+        return [product.id]
+
+    value = cursor_types[sort_by](getattr(product, sort_by))
+    return [value, product.id]
@@ -0,0 +1,117 @@
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
+from responses import FastJSONResponse, validate_responses, dumps
+from dotenv import load_dotenv
+import hashlib
+import re
+import os
+
+load_dotenv()
+
+api_max_age = int(os.getenv("API_CACHE_MAX_AGE", "0"))
+hashed_image = re.compile(r"images/(variants/)?[0-9a-f]{64}[^/]*")
+# If-Match takes either the payload's version or the ETag of a single-resource
+# read; weak tags are refused since If-Match needs a strong comparison
+version_tag = re.compile(r'"?(\d+)"?|"(\d+)-[0-9a-f]{32}"')
+
+
+def make_etag(payload):
+    digest = hashlib.blake2b(dumps(payload), digest_size=16).hexdigest()
+
+    # single collections and products lead with their version, so the ETag a
+    # client was served can be sent back as If-Match on the update; the hash
+    # still changes when an embedded collection title does
+    if isinstance(payload, dict) and "version" in payload:
+        return f'"{payload["version"]}-{digest}"'
+
+    return f'"{digest}"'
+
+
+def cache_entry(payload):
+    # the etag is stored with the payload so cache hits never rehash the body
+    return {"etag": make_etag(payload), "body": payload}
+
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+
+    if header is None:
+        return False
+
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def conditional_response(request: Request, response: Response, entry: dict):
+    headers = {
+        "ETag": entry["etag"],
+        "Cache-Control": f"public, max-age={api_max_age}, must-revalidate",
+    }
+
+    if etag_matches(request, entry["etag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if validate_responses:
+        response.headers.update(headers)
+        return entry["body"]
+
+    # payloads come straight from the database, so skip the response_model pass
+    return FastJSONResponse(entry["body"], headers=headers)
+
+
+def expected_version(request: Request):
+    # writes send back the payload's version as If-Match: "3" or the ETag the
+    # read returned; no header or * means the client does not care what it
+    # overwrites
+    header = request.headers.get("if-match")
+
+    if header is None or header.strip() == "*":
+        return None
+
+    match = version_tag.fullmatch(header.strip())
+
+    if match is None:
+        raise ValueError("the If-Match header must carry the resource version or its ETag")
+
+    return int(match.group(1) or match.group(2))
+
+
+def invalid_if_match_response(request: Request, error: ValueError):
+    return JSONResponse(
+        {
+            "error": str(error),
+            "field": "If-Match",
+            "input": request.headers["if-match"],
+        },
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def version_conflict_response(name: str, current_version: int, entity_id: int = None):
+    content = {
+        "message": f"the {name} was changed by someone else, reload it and try again",
+        "version": current_version,
+    }
+
+    # batch writes have to say which of their rows went stale
+    if entity_id is not None:
+        content["id"] = entity_id
+
+    return JSONResponse(content, status.HTTP_412_PRECONDITION_FAILED)
+
+
+class CatalogStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            if hashed_image.fullmatch(path):
+                # content-addressed files never change under the same name
+                cache_control = "public, max-age=31536000, immutable"
+            else:
+                cache_control = "public, max-age=300"
+
+            response.headers["Cache-Control"] = cache_control
+
+        return response
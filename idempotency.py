@@ -0,0 +1,222 @@
+from fastapi import Request, HTTPException, status
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, update, and_, or_
+from sqlalchemy.exc import IntegrityError
+from database import async_local_session
+from models import IdempotencyKey
+from starlette.datastructures import UploadFile
+from ratelimit import match_route, client_address
+from dotenv import load_dotenv
+from datetime import datetime, timezone, timedelta
+import hashlib
+import json
+import os
+
+load_dotenv()
+
+idempotency_ttl = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+# a claim with no response after this long belongs to a worker that died, so a
+# retry may take it over; keep it above the slowest idempotent request
+idempotency_lease = timedelta(
+    seconds=float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120"))
+)
+
+
+def idempotent(endpoint):
+    endpoint.idempotent = True
+    return endpoint
+
+
+async def claim_key(key: str, fingerprint: str):
+    # returns the claim time when this request now owns the key, else the
+    # stored row; the claim time also proves ownership when storing later
+    now = datetime.now(timezone.utc)
+
+    async with async_local_session() as db:
+        await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                or_(
+                    IdempotencyKey.created_at < now - idempotency_ttl,
+                    and_(
+                        IdempotencyKey.status_code.is_(None),
+                        IdempotencyKey.created_at < now - idempotency_lease,
+                    ),
+                ),
+            )
+        )
+        db.add(IdempotencyKey(key=key, request=fingerprint, created_at=now))
+
+        try:
+            await db.commit()
+            return now, None
+
+        except IntegrityError:
+            await db.rollback()
+            return None, await db.get(IdempotencyKey, key)
+
+
+def owned_claim(key: str, claimed_at: datetime):
+    # a claim taken over after its lease ran out is no longer ours to touch
+    return and_(IdempotencyKey.key == key, IdempotencyKey.created_at == claimed_at)
+
+
+async def store_response(
+    key: str, claimed_at: datetime, status_code: int, media_type: str, body: bytes
+):
+    async with async_local_session() as db:
+        await db.execute(
+            update(IdempotencyKey)
+            .where(owned_claim(key, claimed_at))
+            .values(status_code=status_code, media_type=media_type, body=body)
+        )
+        await db.commit()
+
+
+async def release_key(key: str, claimed_at: datetime):
+    async with async_local_session() as db:
+        await db.execute(delete(IdempotencyKey).where(owned_claim(key, claimed_at)))
+        await db.commit()
+
+
+def is_error_body(media_type: str, body: bytes):
+    # several handlers answer their error shape with a 200, so the status
+    # code alone can not tell whether anything was written
+    if not (media_type or "").startswith("application/json"):
+        return False
+
+    try:
+        content = json.loads(body)
+    except ValueError:
+        return False
+
+    return isinstance(content, dict) and "error" in content
+
+
+def scoped_key(request: Request, key: str):
+    # keys live in one namespace per client, so a guessed or leaked key never
+    # hands another caller's stored response back
+    return hashlib.sha256(f"{client_address(request)}\n{key}".encode()).hexdigest()
+
+
+async def payload_digest(request: Request):
+    # the parsed payload is hashed rather than the raw bytes, because retries
+    # of the same form get a new multipart boundary every time
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    digest = hashlib.sha256()
+
+    if content_type.startswith("application/json"):
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode()
+        except ValueError:
+            pass
+
+        digest.update(body)
+        return digest.hexdigest()
+
+    if not content_type.startswith(
+        ("multipart/form-data", "application/x-www-form-urlencoded")
+    ):
+        digest.update(body)
+        return digest.hexdigest()
+
+    try:
+        async with request.form() as form:
+            fields = []
+
+            for name, value in form.multi_items():
+                if isinstance(value, UploadFile):
+                    value = hashlib.sha256(await value.read()).hexdigest()
+
+                fields.append((name, value))
+    except HTTPException:
+        # a malformed form is rejected by the endpoint itself
+        digest.update(body)
+        return digest.hexdigest()
+
+    digest.update(json.dumps(sorted(fields)).encode())
+    return digest.hexdigest()
+
+
+def replay(stored: IdempotencyKey, key: str, fingerprint: str):
+    if stored.request != fingerprint:
+        return JSONResponse(
+            {
+                "error": "this Idempotency-Key was already used for another request",
+                "field": "Idempotency-Key",
+                "input": key,
+            },
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    if stored.status_code is None:
+        return JSONResponse(
+            {"message": "a request with this Idempotency-Key is still running"},
+            status.HTTP_409_CONFLICT,
+            headers={"Retry-After": "1"},
+        )
+
+    return Response(
+        stored.body,
+        stored.status_code,
+        media_type=stored.media_type,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+async def idempotency_middleware(request: Request, call_next):
+    key = request.headers.get("idempotency-key")
+
+    if key is None or request.method != "POST":
+        return await call_next(request)
+
+    endpoint = getattr(match_route(request), "endpoint", None)
+
+    if not getattr(endpoint, "idempotent", False):
+        return await call_next(request)
+
+    if not 0 < len(key) <= 255:
+        return JSONResponse(
+            {
+                "error": "the Idempotency-Key must be 1 to 255 characters",
+                "field": "Idempotency-Key",
+                "input": key,
+            },
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    fingerprint = (
+        f"{request.method} {request.url.path} {await payload_digest(request)}"
+    )
+    header_key, key = key, scoped_key(request, key)
+    claimed_at, stored = await claim_key(key, fingerprint)
+
+    if stored is not None:
+        return replay(stored, header_key, fingerprint)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await release_key(key, claimed_at)
+        raise
+
+    # rejected and failed requests wrote nothing, so the key is freed for a
+    # corrected retry instead of replaying the error forever
+    if response.status_code >= 400:
+        await release_key(key, claimed_at)
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    media_type = response.headers.get("content-type")
+
+    if is_error_body(media_type, body):
+        await release_key(key, claimed_at)
+    else:
+        await store_response(key, claimed_at, response.status_code, media_type, body)
+
+    async def stored_body():
+        yield body
+
+    response.body_iterator = stored_body()
+    return response
@@ -0,0 +1,306 @@
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Collection, Product
+from schema import CreateCollectionSchema, CreateProductSchema
+from validation import duplicate_collection, duplicate_product, missing_collection
+from validation import error_body
+from stats import apply_product_changes, create_stats, product_facts
+from changefeed import record_changes_where
+from storage import images_dir, is_stored_image
+from dotenv import load_dotenv
+import itertools
+import json
+import csv
+import io
+import os
+
+load_dotenv()
+
+import_batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+
+def row_error(row: int, message: str, field, value):
+    return {"row": row, "error": message, "field": field, "input": value}
+
+
+def file_format(upload):
+    if upload.content_type == "text/csv" or (upload.filename or "").endswith(".csv"):
+        return "csv"
+
+    return "ndjson"
+
+
+def csv_rows(text):
+    reader = csv.DictReader(text)
+
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # the reader carries on with the next line, so only this row fails
+            yield e
+
+
+def open_rows(source, file_format: str):
+    # undecodable bytes are carried through as surrogates, so a bad line is
+    # reported as a row error instead of aborting the import half way
+    text = io.TextIOWrapper(
+        source, encoding="utf-8", errors="surrogateescape", newline=""
+    )
+
+    if file_format == "csv":
+        return enumerate(csv_rows(text), start=1)
+
+    lines = (line.strip() for line in text if line.strip())
+    return enumerate(lines, start=1)
+
+
+def next_batch(rows, batch_size: int):
+    return list(itertools.islice(rows, batch_size))
+
+
+def check_encoding(*texts):
+    for text in texts:
+        if isinstance(text, str):
+            try:
+                text.encode("utf-8")
+            except UnicodeEncodeError:
+                raise ValueError("the row is not valid utf-8")
+
+
+def readable(row):
+    # the echoed input must stay encodable, so bad bytes are shown as U+FFFD
+    if isinstance(row, str):
+        return row.encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+
+    if isinstance(row, dict):
+        return {readable(key): readable(value) for key, value in row.items()}
+
+    return None
+
+
+def parse_row(row):
+    if isinstance(row, csv.Error):
+        raise ValueError(f"the row is not valid csv: {row}")
+
+    if isinstance(row, dict):
+        # DictReader files fields past the header under a None key
+        if row.pop(None, None) is not None:
+            raise ValueError("the row has more fields than the header")
+
+        check_encoding(*row.keys(), *row.values())
+        return row
+
+    check_encoding(row)
+
+    try:
+        row = json.loads(row)
+    except ValueError:
+        raise ValueError("the row is not valid json")
+
+    if not isinstance(row, dict):
+        raise ValueError("each row must be a json object")
+
+    return row
+
+
+def stored_image_path(image_path):
+    # rows may only point at images this app already stored, never at
+    # arbitrary files the orphan collector would later delete
+    if not image_path:
+        return ""
+
+    image_path = str(image_path)
+
+    if not is_stored_image(image_path) or not os.path.isfile(image_path):
+        raise ValueError("the image_path must be an image already in static/images")
+
+    return f"{images_dir}/{os.path.basename(os.path.realpath(image_path))}"
+
+
+class Importer:
+    model = None
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    def validate(self, row: dict):
+        raise NotImplementedError
+
+    async def resolve(self, batch: list):
+        return batch, []
+
+    async def after_insert(self, rows: list):
+        pass
+
+    async def run(self, source, file_format: str, batch_size: int):
+        report = {"inserted": 0, "failed": 0, "errors": []}
+        rows = open_rows(source, file_format)
+
+        while batch := await run_in_threadpool(next_batch, rows, batch_size):
+            valid = []
+
+            for number, row in batch:
+                try:
+                    valid.append((number, self.validate(parse_row(row))))
+
+                except ValidationError as e:
+                    report["errors"].append(
+                        row_error(
+                            number,
+                            e.errors()[0]["msg"],
+                            e.errors()[0]["loc"][-1],
+                            e.errors()[0]["input"],
+                        )
+                    )
+
+                except ValueError as e:
+                    report["errors"].append(
+                        row_error(number, str(e), None, readable(row))
+                    )
+
+            valid, errors = await self.resolve(valid)
+            report["errors"].extend(errors)
+
+            if not valid:
+                continue
+
+            inserted = [values for _, values in valid]
+
+            try:
+                await self.db.execute(insert(self.model), inserted)
+                await self.after_insert(inserted)
+                await self.db.commit()
+                report["inserted"] += len(valid)
+
+            except DBAPIError:
+                # constraint and data errors (e.g. overlong values on Postgres)
+                # only fail this batch, earlier batches are already committed
+                await self.db.rollback()
+                report["errors"].extend(
+                    row_error(number, "the database rejected this batch", None, None)
+                    for number, _ in valid
+                )
+
+        report["failed"] = len(report["errors"])
+        report["errors"].sort(key=lambda error: error["row"])
+
+        return report
+
+
+class CollectionImporter(Importer):
+    model = Collection
+
+    def __init__(self, db: AsyncSession):
+        super().__init__(db)
+        self.seen_titles = set()
+
+    def validate(self, row: dict):
+        return CreateCollectionSchema(**row).model_dump()
+
+    async def after_insert(self, rows: list):
+        titles = [values["title"] for values in rows]
+        await create_stats(self.db, titles)
+        await record_changes_where(
+            self.db, "collection", "create", Collection.title.in_(titles)
+        )
+
+    async def resolve(self, batch: list):
+        titles = [values["title"] for _, values in batch]
+        result = await self.db.execute(
+            select(Collection.title).where(Collection.title.in_(titles))
+        )
+        taken = self.seen_titles | set(result.scalars())
+
+        valid, errors = [], []
+
+        for number, values in batch:
+            if values["title"] in taken:
+                error = error_body(duplicate_collection, "title", values["title"])
+                errors.append({"row": number, **error})
+                continue
+
+            taken.add(values["title"])
+            self.seen_titles.add(values["title"])
+            valid.append((number, values))
+
+        return valid, errors
+
+
+class ProductImporter(Importer):
+    model = Product
+
+    def __init__(self, db: AsyncSession):
+        super().__init__(db)
+        self.seen_titles = set()
+        self.collections = {}
+        self.touched_collections = set()
+
+    def validate(self, row: dict):
+        values = CreateProductSchema(**row).model_dump()
+        values["image_path"] = stored_image_path(row.get("image_path"))
+        return values
+
+    async def after_insert(self, rows: list):
+        await apply_product_changes(
+            self.db,
+            added=[
+                product_facts(values["collection_id"], values["price"], values["menu"])
+                for values in rows
+            ],
+        )
+        self.touched_collections.update(values["collection_id"] for values in rows)
+        await record_changes_where(
+            self.db,
+            "product",
+            "create",
+            Product.title.in_([values["title"] for values in rows]),
+        )
+
+    async def resolve(self, batch: list):
+        titles = [values["title"] for _, values in batch]
+        result = await self.db.execute(
+            select(Product.title).where(Product.title.in_(titles))
+        )
+        taken = self.seen_titles | set(result.scalars())
+
+        unknown_ids = {
+            values["collection_id"]
+            for _, values in batch
+            if values["collection_id"] not in self.collections
+        }
+
+        if unknown_ids:
+            result = await self.db.execute(
+                select(Collection.id).where(Collection.id.in_(unknown_ids))
+            )
+            found = set(result.scalars())
+            self.collections.update(
+                (collection_id, collection_id in found) for collection_id in unknown_ids
+            )
+
+        valid, errors = [], []
+
+        for number, values in batch:
+            if values["title"] in taken:
+                error = error_body(duplicate_product, "title", values["title"])
+                errors.append({"row": number, **error})
+                continue
+
+            if not self.collections[values["collection_id"]]:
+                error = error_body(
+                    missing_collection, "collection_id", values["collection_id"]
+                )
+                errors.append({"row": number, **error})
+                continue
+
+            taken.add(values["title"])
+            self.seen_titles.add(values["title"])
+            valid.append((number, values))
+
+        return valid, errors
@@ -0,0 +1,85 @@
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from database import engin, all_async_engins, replica_session, pool_settings
+from cache import cache_set, close_cache
+from http_cache import cache_entry
+from models import Collection
+from projections import select_collections, collection_from_row
+from storage import images_dir, gc_interval_seconds, sweep_orphan_images
+from variants import variants_dir, shutdown_pool
+from dotenv import load_dotenv
+import logging
+import asyncio
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+warm_connections = int(
+    os.getenv("DB_WARM_CONNECTIONS", str(pool_settings["pool_size"]))
+)
+warm_collections = int(os.getenv("CACHE_WARM_COLLECTIONS", "100"))
+
+
+def prepare_static_dirs():
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(variants_dir, exist_ok=True)
+
+
+async def warm_pool():
+    # opening the connections together leaves them all idle in the pool,
+    # so the first requests after a deploy skip the connect handshake
+    async def ping(engine):
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(
+        *[
+            ping(engine)
+            for engine in all_async_engins
+            for _ in range(warm_connections)
+        ]
+    )
+
+
+async def warm_cache():
+    async with replica_session() as db:
+        result = await db.execute(
+            select_collections().order_by(Collection.id.asc()).limit(warm_collections)
+        )
+
+        for row in result.all():
+            entry = cache_entry(collection_from_row(row))
+            await cache_set(f"collection:{row.id}", entry)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(prepare_static_dirs)
+
+    try:
+        await warm_pool()
+        await warm_cache()
+    except Exception:
+        # a cold start is slower, not broken, so let the worker come up anyway
+        logger.exception("could not warm the connection pool and caches")
+
+    sweeper = None
+
+    if gc_interval_seconds:
+        sweeper = asyncio.create_task(sweep_orphan_images())
+
+    yield
+
+    if sweeper is not None:
+        sweeper.cancel()
+
+    await run_in_threadpool(shutdown_pool)
+    await close_cache()
+    for engine in all_async_engins:
+        await engine.dispose()
+
+    engin.dispose()
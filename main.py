@@ -1,31 +1,78 @@
 from fastapi import FastAPI, Depends, Query, status, UploadFile
-from fastapi import Request, File, Form
+from fastapi import Request, Response, File, Form, BackgroundTasks
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
-from dependencies import get_db_fast
-from sqlalchemy.orm import Session, joinedload
-from models import Collection, Product
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from dependencies import get_db, get_read_db
+from sqlalchemy import select, func, delete, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Collection, CollectionStats, Product
 from schema import GetAllCollectionsSchema, CreateCollectionSchema
 from schema import UpdateCollectionSchema, GetCollectionSchema
 from schema import GetProductSchema, GetAllProductsSchema, CreateProductSchema
-from schema import UpdateProductSchema
-import uvicorn
-import shutil
+from schema import UpdateProductSchema, BatchUpdateProductsSchema
+from schema import CursorCollectionsSchema, CursorProductsSchema
+from schema import SearchProductsSchema
+from schema import BatchProductsSchema, BatchProductsRequestSchema
+from schema import ChangesSchema
+from pagination import encode_cursor, decode_cursor
+from validation import check_collection, check_product, check_products, error_body
+from validation import duplicate_collection, duplicate_product
+from cache import cache_get, cache_set, cache_stats, list_key, invalidate
+from cache import cache_get_many, cache_set_many
+from typing import Union
+from storage import save_image, ImageTooLarge, remove_unreferenced_images
+from storage import image_upload, upload_size_middleware
+from variants import generate_variants
+from responses import FastJSONResponse
+from http_cache import CatalogStaticFiles, cache_entry, conditional_response
+from http_cache import expected_version, invalid_if_match_response
+from http_cache import version_conflict_response
+from importer import CollectionImporter, ProductImporter
+from importer import file_format, import_batch_size
+from search import search_products as run_search
+from filters import filter_products, sort_products, sort_keys, seek_products
+from filters import cursor_values
+from projections import select_products, product_from_row
+from projections import select_collections, collection_from_row
+from stats import apply_product_changes, product_facts, product_fact_fields
+from metrics import metrics_middleware, render_metrics
+from querybudget import query_budget, query_budget_middleware, polling
+from lifecycle import lifespan
+from export import export_products, media_types
+from changefeed import change_rows, record_changes, record_changes_where
+from changefeed import wait_for_changes, stream_changes
+from datetime import datetime
+from collections import defaultdict
+from replicas import read_your_writes_middleware, read_only, skips_cache
+from ratelimit import admission_middleware, rate_limit, admission_exempt, long_lived
+from idempotency import idempotency_middleware, idempotent
+from dotenv import load_dotenv
+import server
 import os
 
-app = FastAPI(debug=True)
+load_dotenv()
 
-if not os.path.isdir("static"):
-    os.mkdir("static")
-    print("static folder created...")
+debug = os.getenv("DEBUG", "false").lower() == "true"
 
-if not os.path.isdir("static/images"):
-    os.mkdir("static/images")
-    print("images folder created...")
+app = FastAPI(
+    debug=debug,
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
+app.middleware("http")(read_your_writes_middleware)
+app.middleware("http")(query_budget_middleware)
+app.middleware("http")(idempotency_middleware)
+app.middleware("http")(upload_size_middleware)
+app.middleware("http")(admission_middleware)
+app.middleware("http")(metrics_middleware)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-images_dir = "static/images"
+# the lifespan hook creates the folders, so the mount must not check for them
+app.mount(
+    "/static",
+    CatalogStaticFiles(directory="static", check_dir=False),
+    name="static",
+)
 
 
 @app.exception_handler(RequestValidationError)
@@ -45,15 +92,31 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
+async def read_cache(request: Request, key: str):
+    if skips_cache(request):
+        return None
+
+    return await cache_get(key)
+
+
 @app.get("/get-collection/{collection_id}", response_model=GetCollectionSchema)
+@query_budget(1)
 async def get_collection(
     collection_id: int,
-    db: Session = Depends(get_db_fast),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
 ):
+    key = f"collection:{collection_id}"
+    entry = await read_cache(request, key)
+
+    if entry is not None:
+        return conditional_response(request, response, entry)
 
-    collection_query = (
-        db.query(Collection).filter(Collection.id == collection_id).first()
+    result = await db.execute(
+        select_collections().where(Collection.id == collection_id)
     )
+    collection_query = result.first()
 
     if collection_query is None:
         return JSONResponse(
@@ -61,49 +124,155 @@ async def get_collection(
             status.HTTP_404_NOT_FOUND,
         )
 
-    return {"id": collection_query.id, "title": collection_query.title}
+    entry = cache_entry(collection_from_row(collection_query))
+    await cache_set(key, entry)
+
+    return conditional_response(request, response, entry)
+
+
+def invalid_cursor_response(after: str):
+    return JSONResponse(
+        {"error": "the cursor is not valid", "field": "after", "input": after},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def image_too_large_response(error: ImageTooLarge, product_image: UploadFile):
+    return JSONResponse(
+        {
+            "error": str(error),
+            "field": "product_image",
+            "input": product_image.filename,
+        },
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
+async def count_rows(db: AsyncSession, model):
+    return await db.scalar(select(func.count()).select_from(model))
+
 
+async def count_products(db: AsyncSession, **filters):
+    return await db.scalar(filter_products(select(func.count(Product.id)), **filters))
 
-@app.get("/get-all-collections", response_model=GetAllCollectionsSchema)
+
+@app.get(
+    "/get-all-collections",
+    response_model=Union[GetAllCollectionsSchema, CursorCollectionsSchema],
+)
+@query_budget(2)
+@rate_limit(10, 30)
 async def get_all_collections(
+    request: Request,
+    response: Response,
     page: int = Query(1, ge=1),
-    per_page: int = Query(16, le=20),
-    db: Session = Depends(get_db_fast),
+    per_page: int = Query(16, ge=1, le=20),
+    cursor: bool = Query(False),
+    after: str = Query(None),
+    with_total: bool = Query(False),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    total_items = db.query(Collection).count()
-    skip = (page - 1) * per_page
-
-    collections_query = (
-        db.query(Collection)
-        .order_by(Collection.id.asc())
-        .offset(skip)
-        .limit(per_page)
-        .all()
+    cursor = cursor or after is not None
+    key = await list_key(
+        "collections",
+        page=None if cursor else page,
+        per_page=per_page,
+        after=after if cursor else None,
+        with_total=with_total if cursor else None,
     )
+    entry = await read_cache(request, key)
 
-    has_next = (skip + per_page) < total_items
-    has_previous = page > 1
+    if entry is not None:
+        return conditional_response(request, response, entry)
 
-    return {
-        "page": page,
-        "per_page": per_page,
-        "total_items": total_items,
-        "has_next": has_next,
-        "has_previous": has_previous,
-        "items": collections_query,
-    }
+    if cursor:
+        query = select_collections()
+
+        if after is not None:
+            try:
+                (last_id,) = decode_cursor(after)
+                last_id = int(last_id)
+            except (TypeError, ValueError):
+                return invalid_cursor_response(after)
+
+            query = query.where(Collection.id > last_id)
+
+        result = await db.execute(
+            query.order_by(Collection.id.asc()).limit(per_page + 1)
+        )
+        rows = result.all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+
+        payload = {
+            "per_page": per_page,
+            "total_items": await count_rows(db, Collection) if with_total else None,
+            "has_next": has_next,
+            "next_cursor": encode_cursor(rows[-1].id) if has_next else None,
+            "items": [collection_from_row(row) for row in rows],
+        }
+
+    else:
+        total_items = await count_rows(db, Collection)
+        skip = (page - 1) * per_page
+
+        result = await db.execute(
+            select_collections()
+            .order_by(Collection.id.asc())
+            .offset(skip)
+            .limit(per_page)
+        )
+        collections_query = result.all()
+
+        has_next = (skip + per_page) < total_items
+        has_previous = page > 1
+
+        payload = {
+            "page": page,
+            "per_page": per_page,
+            "total_items": total_items,
+            "has_next": has_next,
+            "has_previous": has_previous,
+            "items": [collection_from_row(row) for row in collections_query],
+        }
+
+    entry = cache_entry(payload)
+    await cache_set(key, entry)
+
+    return conditional_response(request, response, entry)
 
 
 @app.post("/create-collection")
+@query_budget(4)
+@idempotent
 async def create_collection(
     input_collection: CreateCollectionSchema,
-    db: Session = Depends(get_db_fast),
+    db: AsyncSession = Depends(get_db),
 ):
-    new_collection = Collection(**input_collection.model_dump())
+    error = await check_collection(db, input_collection.title)
+
+    if error is not None:
+        return JSONResponse(error, status.HTTP_400_BAD_REQUEST)
 
+    new_collection = Collection(
+        **input_collection.model_dump(), stats=CollectionStats()
+    )
     db.add(new_collection)
-    db.commit()
-    db.refresh(new_collection)
+
+    try:
+        await db.flush()
+        await record_changes(
+            db, change_rows("collection", "create", [new_collection.id])
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return JSONResponse(
+            error_body(duplicate_collection, "title", input_collection.title),
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    await invalidate(lists=("collections",))
 
     return {
         "response": "new collection by the name of "
@@ -112,21 +281,13 @@ async def create_collection(
 
 
 @app.patch("/update-collection/{collection_id}")
+@query_budget(4)
 async def update_collection(
+    request: Request,
     collection_id: int,
     title: str = Form(None),
-    db: Session = Depends(get_db_fast),
+    db: AsyncSession = Depends(get_db),
 ):
-    collection_query = (
-        db.query(Collection).filter(Collection.id == collection_id).first()
-    )
-
-    if collection_query is None:
-        return JSONResponse(
-            {"message": "we do not have such this collection"},
-            status.HTTP_404_NOT_FOUND,
-        )
-
     try:
         input_collection = UpdateCollectionSchema(title=title)
 
@@ -137,54 +298,149 @@ async def update_collection(
             "input": e.errors()[0]["input"],
         }
 
-    for key, value in input_collection.model_dump().items():
-        if value is not None:
-            setattr(collection_query, key, value)
+    try:
+        version = expected_version(request)
+    except ValueError as e:
+        return invalid_if_match_response(request, e)
+
+    values = {
+        key: value
+        for key, value in input_collection.model_dump().items()
+        if value is not None
+    }
+
+    # the version check and the write are one statement, so nothing can slip
+    # in between them; the unique title constraint catches duplicates
+    statement = update(Collection).where(Collection.id == collection_id)
+
+    if version is not None:
+        statement = statement.where(Collection.version == version)
+
+    try:
+        new_version = await db.scalar(
+            statement.values(**values, version=Collection.version + 1).returning(
+                Collection.version
+            )
+        )
+    except IntegrityError:
+        await db.rollback()
+        return error_body(duplicate_collection, "title", input_collection.title)
+
+    if new_version is None:
+        current_version = await db.scalar(
+            select(Collection.version).where(Collection.id == collection_id)
+        )
+        await db.rollback()
+
+        if current_version is None:
+            return JSONResponse(
+                {"message": "we do not have such this collection"},
+                status.HTTP_404_NOT_FOUND,
+            )
+
+        return version_conflict_response("collection", current_version)
+
+    product_keys = []
+
+    if input_collection.title is not None:
+        # exported products embed the title, so incremental syncs must see them
+        result = await db.execute(
+            update(Product)
+            .where(Product.collection_id == collection_id)
+            .values(updated_at=func.now())
+            .returning(Product.id)
+        )
+        product_keys = [f"product:{product_id}" for product_id in result.scalars()]
+        await record_changes_where(
+            db, "product", "update", Product.collection_id == collection_id
+        )
+
+    await record_changes(db, change_rows("collection", "update", [collection_id]))
+    await db.commit()
 
-    db.commit()
+    # product payloads embed the collection title, so they go stale as well
+    await invalidate(
+        f"collection:{collection_id}",
+        *product_keys,
+        lists=("collections", "products"),
+    )
 
     return JSONResponse(
-        {"message": "the collection updated successfully"},
+        {"message": "the collection updated successfully", "version": new_version},
         status.HTTP_202_ACCEPTED,
     )
 
 
 @app.delete("/delete-collection/{collection_id}")
+@query_budget(3)
 async def delete_collection(
+    background_tasks: BackgroundTasks,
     collection_id: int,
-    db: Session = Depends(get_db_fast),
+    db: AsyncSession = Depends(get_db),
 ):
+    # one set-based DELETE for the children; the FK also cascades on its own
+    result = await db.execute(
+        delete(Product)
+        .where(Product.collection_id == collection_id)
+        .returning(Product.id, Product.image_path)
+    )
+    deleted_products = result.all()
 
-    collection_query = (
-        db.query(Collection).filter(Collection.id == collection_id).first()
+    collection_title = await db.scalar(
+        delete(Collection)
+        .where(Collection.id == collection_id)
+        .returning(Collection.title)
     )
 
-    if collection_query is None:
+    if collection_title is None:
+        await db.rollback()
         return JSONResponse(
             {"message": "we do not have such this collection"},
             status.HTTP_404_NOT_FOUND,
         )
 
-    db.delete(collection_query)
-    db.commit()
+    await record_changes(
+        db,
+        change_rows("product", "delete", [product.id for product in deleted_products])
+        + change_rows("collection", "delete", [collection_id]),
+    )
+    await db.commit()
+
+    await invalidate(
+        f"collection:{collection_id}",
+        *[f"product:{product.id}" for product in deleted_products],
+        lists=("collections", "products"),
+    )
+    background_tasks.add_task(
+        remove_unreferenced_images,
+        [product.image_path for product in deleted_products],
+    )
 
     return JSONResponse(
         {
             "message": "the collection with name of "
-            f"{collection_query.title} has been deleted successfully"
+            f"{collection_title} has been deleted successfully"
         },
         status.HTTP_202_ACCEPTED,
     )
 
 
 @app.get("/get-product/{product_id}", response_model=GetProductSchema)
-async def get_product(product_id: int, db: Session = Depends(get_db_fast)):
-    product_query = (
-        db.query(Product)
-        .options(joinedload(Product.collection))
-        .filter(Product.id == product_id)
-        .first()
-    )
+@query_budget(1)
+async def get_product(
+    product_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+):
+    key = f"product:{product_id}"
+    entry = await read_cache(request, key)
+
+    if entry is not None:
+        return conditional_response(request, response, entry)
+
+    result = await db.execute(select_products().where(Product.id == product_id))
+    product_query = result.first()
 
     if product_query is None:
         return JSONResponse(
@@ -192,74 +448,254 @@ async def get_product(product_id: int, db: Session = Depends(get_db_fast)):
             status.HTTP_404_NOT_FOUND,
         )
 
+    entry = cache_entry(product_from_row(product_query))
+    await cache_set(key, entry)
+
+    return conditional_response(request, response, entry)
+
+
+async def load_products(db: AsyncSession, product_ids: list, use_cache: bool = True):
+    unique_ids = list(dict.fromkeys(product_ids))
+    keys = [f"product:{product_id}" for product_id in unique_ids]
+    entries = await cache_get_many(keys) if use_cache else [None] * len(keys)
+
+    products = {
+        product_id: entry["body"]
+        for product_id, entry in zip(unique_ids, entries)
+        if entry is not None
+    }
+    missing_ids = [
+        product_id for product_id in unique_ids if product_id not in products
+    ]
+
+    if missing_ids:
+        result = await db.execute(
+            select_products().where(Product.id.in_(missing_ids))
+        )
+        fresh = {}
+
+        for row in result.all():
+            products[row.id] = product_from_row(row)
+            fresh[f"product:{row.id}"] = cache_entry(products[row.id])
+
+        await cache_set_many(fresh)
+
     return {
-        "id": product_query.id,
-        "title": product_query.title,
-        "price": product_query.price,
-        "description": product_query.description,
-        "menu": product_query.menu,
-        "collection_id": product_query.collection_id,
-        "image_path": product_query.image_path,
-        "collection_title": product_query.collection.title,
+        "items": [
+            {
+                "id": product_id,
+                "found": product_id in products,
+                "product": products.get(product_id),
+            }
+            for product_id in product_ids
+        ]
     }
 
 
-@app.get("/get-all-products", response_model=GetAllProductsSchema)
+def batch_response(request: Request, response: Response, payload: dict):
+    # batches are not cached as a whole, but clients can still revalidate
+    return conditional_response(request, response, cache_entry(payload))
+
+
+@app.get("/get-products", response_model=BatchProductsSchema)
+@query_budget(1)
+async def get_products(
+    request: Request,
+    response: Response,
+    ids: str = Query(pattern=r"^\d+(,\d+)*$"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    product_ids = [int(product_id) for product_id in ids.split(",")]
+
+    if len(product_ids) > 100:
+        return JSONResponse(
+            {
+                "error": "at most 100 product ids fit in the query string, "
+                "use POST /get-products for longer lists",
+                "field": "ids",
+                "input": ids,
+            },
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    payload = await load_products(db, product_ids, not skips_cache(request))
+    return batch_response(request, response, payload)
+
+
+@app.post("/get-products", response_model=BatchProductsSchema)
+@query_budget(1)
+@read_only
+async def post_get_products(
+    input_ids: BatchProductsRequestSchema,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+):
+    payload = await load_products(db, input_ids.ids, not skips_cache(request))
+    return batch_response(request, response, payload)
+
+
+@app.get(
+    "/get-all-products",
+    response_model=Union[GetAllProductsSchema, CursorProductsSchema],
+)
+@query_budget(2)
+@rate_limit(10, 30)
 async def get_all_products(
+    request: Request,
+    response: Response,
     page: int = Query(1, ge=1),
-    per_page: int = Query(16, le=20),
-    db: Session = Depends(get_db_fast),
+    per_page: int = Query(16, ge=1, le=20),
+    cursor: bool = Query(False),
+    after: str = Query(None),
+    with_total: bool = Query(False),
+    collection_id: int = Query(None),
+    menu: str = Query(None, pattern="^(casual|special)$"),
+    min_price: int = Query(None, ge=0),
+    max_price: int = Query(None, ge=0),
+    sort_by: str = Query("id", pattern="^(id|price|title)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    fields: str = Query("full", pattern="^(full|summary)$"),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    total_items = db.query(Product).count()
-    skip = (page - 1) * per_page
-
-    products_query = (
-        db.query(Product)
-        .order_by(Product.id.asc())
-        .options(joinedload(Product.collection))
-        .offset(skip)
-        .limit(per_page)
-        .all()
+    cursor = cursor or after is not None
+    filters = {
+        "collection_id": collection_id,
+        "menu": menu,
+        "min_price": min_price,
+        "max_price": max_price,
+    }
+    key = await list_key(
+        "products",
+        page=None if cursor else page,
+        per_page=per_page,
+        after=after if cursor else None,
+        with_total=with_total if cursor else None,
+        sort_by=sort_by,
+        order=order,
+        fields=fields,
+        **filters,
     )
+    entry = await read_cache(request, key)
+
+    if entry is not None:
+        return conditional_response(request, response, entry)
+
+    query = filter_products(select_products(fields), **filters)
+    query = sort_products(query, sort_by, order)
+
+    if cursor:
+        if after is not None:
+            try:
+                values = decode_cursor(after, size=len(sort_keys(sort_by)))
+                query = seek_products(query, sort_by, order, values)
+            except (TypeError, ValueError):
+                return invalid_cursor_response(after)
+
+        result = await db.execute(query.limit(per_page + 1))
+        rows = result.all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+
+        if with_total:
+            total_items = await count_products(db, **filters)
+        else:
+            total_items = None
+
+        if has_next:
+            next_cursor = encode_cursor(*cursor_values(rows[-1], sort_by))
+        else:
+            next_cursor = None
+
+        payload = {
+            "per_page": per_page,
+            "total_items": total_items,
+            "has_next": has_next,
+            "next_cursor": next_cursor,
+            "items": [product_from_row(row) for row in rows],
+        }
+
+    else:
+        total_items = await count_products(db, **filters)
+        skip = (page - 1) * per_page
 
-    items = []
-
-    for product in products_query:
-        product_data = {
-            "id": product.id,
-            "title": product.title,
-            "price": product.price,
-            "description": product.description,
-            "menu": product.menu,
-            "collection_id": product.collection_id,
-            "image_path": product.image_path,
-            "collection_title": product.collection.title,
+        result = await db.execute(query.offset(skip).limit(per_page))
+        products_query = result.all()
+
+        has_next = (skip + per_page) < total_items
+        has_previous = page > 1
+
+        payload = {
+            "page": page,
+            "per_page": per_page,
+            "total_items": total_items,
+            "has_next": has_next,
+            "has_previous": has_previous,
+            "items": [product_from_row(row) for row in products_query],
         }
 
-        items.append(product_data)
+    entry = cache_entry(payload)
+    await cache_set(key, entry)
+
+    return conditional_response(request, response, entry)
 
-    has_next = (skip + per_page) < total_items
-    has_previous = page > 1
+
+@app.get("/search-products", response_model=SearchProductsSchema)
+@query_budget(1)
+@rate_limit(5, 20)
+async def search_products(
+    q: str = Query(min_length=1, max_length=100),
+    menu: str = Query(None, pattern="^(casual|special)$"),
+    collection_id: int = Query(None),
+    min_price: int = Query(None, ge=0),
+    max_price: int = Query(None, ge=0),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(16, ge=1, le=20),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if not q.strip():
+        return JSONResponse(
+            {"error": "the search text is required", "field": "q", "input": q},
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    skip = (page - 1) * per_page
+
+    products = await run_search(
+        db,
+        q.strip(),
+        menu=menu,
+        collection_id=collection_id,
+        min_price=min_price,
+        max_price=max_price,
+        offset=skip,
+        limit=per_page + 1,
+    )
 
     return {
+        "query": q,
         "page": page,
         "per_page": per_page,
-        "total_items": total_items,
-        "has_next": has_next,
-        "has_previous": has_previous,
-        "items": items,
+        "has_next": len(products) > per_page,
+        "has_previous": page > 1,
+        "items": [product_from_row(row) for row in products[:per_page]],
     }
 
 
 @app.post("/create-product")
+@query_budget(4)
+@rate_limit(2, 10, concurrency=8)
+@idempotent
+@image_upload
 async def create_product(
+    background_tasks: BackgroundTasks,
     title: str = Form(),
     price: int = Form(),
     description: str = Form(),
     menu: str = Form(),
     collection_id: int = Form(),
     product_image: UploadFile = File(),
-    db: Session = Depends(get_db_fast),
+    db: AsyncSession = Depends(get_db),
 ):
     try:
         input_product = CreateProductSchema(
@@ -276,19 +712,40 @@ async def create_product(
             "input": e.errors()[0]["input"],
         }
 
-    file_location = f"{images_dir}/{product_image.filename}"
+    error = await check_product(db, title, collection_id)
 
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(product_image.file, buffer)
+    if error is not None:
+        return error
 
-    product_image_path = f"static/images/{product_image.filename}"
+    try:
+        product_image_path = await save_image(product_image)
+    except ImageTooLarge as e:
+        return image_too_large_response(e, product_image)
 
     new_product = Product(**input_product.model_dump())
     new_product.image_path = product_image_path
 
     db.add(new_product)
-    db.commit()
-    db.refresh(new_product)
+
+    try:
+        await db.flush()
+        await record_changes(db, change_rows("product", "create", [new_product.id]))
+        await apply_product_changes(
+            db, added=[product_facts(collection_id, price, input_product.menu)]
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return await check_product(db, title, collection_id) or error_body(
+            duplicate_product, "title", title
+        )
+
+    await invalidate(
+        f"collection:{collection_id}", lists=("products", "collections")
+    )
+    background_tasks.add_task(
+        generate_variants, product_image_path, f"product:{new_product.id}"
+    )
 
     return JSONResponse(
         {
@@ -299,7 +756,12 @@ async def create_product(
 
 
 @app.patch("/update-product/{product_id}")
+@query_budget(6)
+@rate_limit(5, 20, concurrency=8)
+@image_upload
 async def update_product(
+    request: Request,
+    background_tasks: BackgroundTasks,
     product_id: int,
     title: str = Form(None),
     price: int = Form(None),
@@ -307,16 +769,8 @@ async def update_product(
     menu: str = Form(None),
     collection_id: int = Form(None),
     product_image: UploadFile = File(None),
-    db: Session = Depends(get_db_fast),
+    db: AsyncSession = Depends(get_db),
 ):
-    product_query = db.query(Product).filter(Product.id == product_id).first()
-
-    if product_query is None:
-        return JSONResponse(
-            {"message": "we do not have such this product"},
-            status.HTTP_404_NOT_FOUND,
-        )
-
     try:
         input_product = UpdateProductSchema(
             title=title,
@@ -332,26 +786,328 @@ async def update_product(
             "input": e.errors()[0]["input"],
         }
 
+    try:
+        version = expected_version(request)
+    except ValueError as e:
+        return invalid_if_match_response(request, e)
+
+    values = input_product.model_dump(exclude_none=True)
+
     if product_image:
-        file_location = f"{images_dir}/{product_image.filename}"
+        try:
+            values["image_path"] = await save_image(product_image)
+        except ImageTooLarge as e:
+            return image_too_large_response(e, product_image)
+
+        # if the update fails below, the periodic orphan sweep removes the file
+        # once it is older than IMAGE_GC_GRACE_SECONDS
+
+    old_product = None
+
+    if product_fact_fields & values.keys() or product_image:
+        # stats deltas and image cleanup need the values being replaced, so
+        # read them under a row lock; title and description edits skip this
+        result = await db.execute(
+            select(
+                Product.collection_id,
+                Product.price,
+                Product.menu,
+                Product.image_path,
+            )
+            .where(Product.id == product_id)
+            .with_for_update()
+        )
+        old_product = result.one_or_none()
 
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(product_image.file, buffer)
+    statement = update(Product).where(Product.id == product_id)
 
-        product_image_path = f"static/images/{product_image.filename}"
-        product_query.image_path = product_image_path
+    if version is not None:
+        statement = statement.where(Product.version == version)
 
-    for key, value in input_product.model_dump().items():
-        if value is not None:
-            setattr(product_query, key, value)
+    try:
+        result = await db.execute(
+            statement.values(**values, version=Product.version + 1).returning(
+                Product.collection_id, Product.price, Product.menu, Product.version
+            )
+        )
+        new_product = result.one_or_none()
+    except IntegrityError:
+        # the unique title and the collection foreign key do the checking
+        await db.rollback()
+        return await check_product(db, collection_id=collection_id) or error_body(
+            duplicate_product, "title", title
+        )
+
+    if new_product is None:
+        current_version = await db.scalar(
+            select(Product.version).where(Product.id == product_id)
+        )
+        await db.rollback()
+
+        if current_version is None:
+            return JSONResponse(
+                {"message": "we do not have such this product"},
+                status.HTTP_404_NOT_FOUND,
+            )
+
+        return version_conflict_response("product", current_version)
+
+    old_facts = new_facts = None
+
+    if old_product is not None:
+        old_facts = product_facts(
+            old_product.collection_id, old_product.price, old_product.menu
+        )
+        new_facts = product_facts(
+            new_product.collection_id, new_product.price, new_product.menu
+        )
+
+    if new_facts != old_facts:
+        await apply_product_changes(db, removed=[old_facts], added=[new_facts])
+
+    await record_changes(db, change_rows("product", "update", [product_id]))
+    await db.commit()
+
+    if new_facts != old_facts:
+        await invalidate(
+            f"product:{product_id}",
+            *{f"collection:{old_facts[0]}", f"collection:{new_facts[0]}"},
+            lists=("products", "collections"),
+        )
+    else:
+        await invalidate(f"product:{product_id}", lists=("products",))
 
-    db.commit()
+    if product_image:
+        background_tasks.add_task(
+            generate_variants, values["image_path"], f"product:{product_id}"
+        )
+        background_tasks.add_task(remove_unreferenced_images, [old_product.image_path])
 
     return JSONResponse(
-        {"message": "the product updated successfully"},
+        {
+            "message": "the product updated successfully",
+            "version": new_product.version,
+        },
         status.HTTP_202_ACCEPTED,
     )
 
 
+@app.patch("/update-products")
+@query_budget(8)
+@rate_limit(1, 5, concurrency=2)
+async def update_products(
+    input_products: BatchUpdateProductsSchema,
+    db: AsyncSession = Depends(get_db),
+):
+    items = input_products.items
+    product_ids = [item.id for item in items]
+
+    # one locked read gives every version to check and every value the stats
+    # deltas need, instead of a round-trip per product
+    result = await db.execute(
+        select(
+            Product.id,
+            Product.version,
+            Product.collection_id,
+            Product.price,
+            Product.menu,
+        )
+        .where(Product.id.in_(product_ids))
+        .with_for_update()
+    )
+    old_products = {row.id: row for row in result}
+    missing = [
+        product_id for product_id in product_ids if product_id not in old_products
+    ]
+
+    if missing:
+        await db.rollback()
+        return JSONResponse(
+            {"message": "we do not have some of these products", "ids": missing},
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    for item in items:
+        current_version = old_products[item.id].version
+
+        if item.version is not None and item.version != current_version:
+            await db.rollback()
+            return version_conflict_response("product", current_version, item.id)
+
+    groups = defaultdict(list)
+    removed, added = [], []
+
+    for item in items:
+        values = item.model_dump(exclude={"id", "version"}, exclude_none=True)
+        old = old_products[item.id]
+        params = {f"new_{key}": value for key, value in values.items()}
+        groups[tuple(sorted(values))].append({"product_id": item.id, **params})
+
+        old_facts = product_facts(old.collection_id, old.price, old.menu)
+        new_facts = product_facts(
+            values.get("collection_id", old.collection_id),
+            values.get("price", old.price),
+            values.get("menu", old.menu),
+        )
+
+        if new_facts != old_facts:
+            removed.append(old_facts)
+            added.append(new_facts)
+
+    products = Product.__table__
+
+    try:
+        # products that change the same fields share one executemany UPDATE
+        for fields, params in groups.items():
+            await db.execute(
+                update(products)
+                .where(products.c.id == bindparam("product_id"))
+                .values(
+                    {
+                        **{field: bindparam(f"new_{field}") for field in fields},
+                        "version": products.c.version + 1,
+                    }
+                ),
+                params,
+            )
+
+        if added:
+            await apply_product_changes(db, removed=removed, added=added)
+
+        await record_changes(db, change_rows("product", "update", product_ids))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return await check_products(db, items) or error_body(
+            duplicate_product, "title", None
+        )
+
+    collection_keys = {f"collection:{facts[0]}" for facts in removed + added}
+
+    await invalidate(
+        *[f"product:{product_id}" for product_id in product_ids],
+        *collection_keys,
+        lists=("products", "collections") if added else ("products",),
+    )
+
+    return JSONResponse(
+        {
+            "message": "the products updated successfully",
+            "items": [
+                {"id": item.id, "version": old_products[item.id].version + 1}
+                for item in items
+            ],
+        },
+        status.HTTP_202_ACCEPTED,
+    )
+
+
+@app.post("/import-collections")
+@rate_limit(0.1, 2, concurrency=1)
+@idempotent
+async def import_collections(
+    catalog_file: UploadFile = File(),
+    batch_size: int = Query(import_batch_size, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db),
+):
+    report = await CollectionImporter(db).run(
+        catalog_file.file, file_format(catalog_file), batch_size
+    )
+
+    if report["inserted"]:
+        await invalidate(lists=("collections",))
+
+    return report
+
+
+@app.post("/import-products")
+@rate_limit(0.1, 2, concurrency=1)
+@idempotent
+async def import_products(
+    catalog_file: UploadFile = File(),
+    batch_size: int = Query(import_batch_size, ge=1, le=10000),
+    db: AsyncSession = Depends(get_db),
+):
+    importer = ProductImporter(db)
+    report = await importer.run(
+        catalog_file.file, file_format(catalog_file), batch_size
+    )
+
+    if report["inserted"]:
+        await invalidate(
+            *[f"collection:{i}" for i in importer.touched_collections],
+            lists=("products", "collections"),
+        )
+
+    return report
+
+
+@app.get("/export-products")
+@rate_limit(0.1, 2, concurrency=2)
+async def export_catalog(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    updated_since: datetime = Query(None),
+):
+    return StreamingResponse(
+        export_products(format, updated_since),
+        media_type=media_types[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="products.{format}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+@app.get("/changes", response_model=ChangesSchema)
+@polling
+@long_lived
+async def get_changes(
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=30),
+    db: AsyncSession = Depends(get_read_db),
+):
+    changes = await wait_for_changes(db, after, limit, wait)
+
+    return {
+        "next_after": changes[-1]["seq"] if changes else after,
+        "changes": changes,
+    }
+
+
+@app.get("/changes/stream")
+@rate_limit(1, 5)
+@long_lived
+async def stream_catalog_changes(
+    request: Request,
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # EventSource resends the original url on reconnect, so the header wins
+    last_event_id = request.headers.get("last-event-id", "")
+
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+
+    return StreamingResponse(
+        stream_changes(after, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    return cache_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+@admission_exempt
+async def get_metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4"
+    )
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    server.main()
@@ -0,0 +1,201 @@
+from fastapi import Request
+from sqlalchemy import event
+from contextvars import ContextVar
+from collections import defaultdict
+from database import all_async_engins, TimedQueuePool
+from cache import cache_stats
+from ratelimit import match_route
+import time
+
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+request_stats = ContextVar("request_stats", default=None)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = defaultdict(float)
+        registry.append(self)
+
+    def inc(self, amount: float = 1, *labels):
+        self.values[labels] += amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+    def render(self):
+        header = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        return header + list(self.samples())
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=default_buckets):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self.counts = defaultdict(lambda: [0] * len(buckets))
+        self.sums = defaultdict(float)
+        self.totals = defaultdict(int)
+
+    def observe(self, value: float, *labels):
+        counts = self.counts[labels]
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+
+        self.sums[labels] += value
+        self.totals[labels] += 1
+
+    def samples(self):
+        for labels, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                bucket = format_labels(self.labels, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{bucket} {count}"
+
+            bucket = format_labels(self.labels, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{bucket} {self.totals[labels]}"
+
+            label_text = format_labels(self.labels, labels)
+            yield f"{self.name}_sum{label_text} {self.sums[labels]}"
+            yield f"{self.name}_count{label_text} {self.totals[labels]}"
+
+
+registry = []
+
+http_requests = Counter(
+    "http_requests_total",
+    "Requests handled, by route and status code.",
+    ("method", "route", "status"),
+)
+http_duration = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route.",
+    ("method", "route"),
+)
+http_in_progress = Gauge("http_requests_in_progress", "Requests being handled.")
+request_queries = Histogram(
+    "http_request_db_queries",
+    "SQL statements executed per request.",
+    ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+db_queries = Counter("db_queries_total", "SQL statements executed.")
+db_duration = Histogram("db_query_duration_seconds", "SQL statement latency.")
+pool_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection.",
+)
+pool_in_use = Gauge("db_pool_connections_in_use", "Connections checked out.")
+cache_hits = Gauge("cache_hits", "Read-through cache hits since start.")
+cache_misses = Gauge("cache_misses", "Read-through cache misses since start.")
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_started = time.perf_counter()
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.metrics_started
+
+    db_queries.inc()
+    db_duration.observe(elapsed)
+
+    stats = request_stats.get()
+
+    if stats is not None:
+        stats["queries"] += 1
+        stats["query_seconds"] += elapsed
+
+
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_in_use.inc(1)
+
+
+def count_checkin(dbapi_connection, connection_record):
+    pool_in_use.inc(-1)
+
+
+# replicas count toward the same totals as the primary
+for engine in all_async_engins:
+    event.listen(engine.sync_engine, "before_cursor_execute", start_query_timer)
+    event.listen(engine.sync_engine, "after_cursor_execute", record_query)
+    event.listen(engine.sync_engine.pool, "checkout", count_checkout)
+    event.listen(engine.sync_engine.pool, "checkin", count_checkin)
+
+TimedQueuePool.wait_listeners.append(pool_wait.observe)
+
+
+def route_name(request: Request):
+    route = request.scope.get("route")
+
+    if route is not None:
+        return route.path
+
+    # mounted apps such as /static only leave their prefix in root_path
+    return request.scope.get("root_path") or "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    # registered last, so this runs first and resolves the route for the
+    # admission, upload size and idempotency middlewares behind it
+    match_route(request)
+    stats = {"queries": 0, "query_seconds": 0.0}
+    token = request_stats.set(stats)
+    http_in_progress.inc(1)
+    started = time.perf_counter()
+    status_code = 500
+
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+
+    finally:
+        elapsed = time.perf_counter() - started
+        route = route_name(request)
+
+        http_in_progress.inc(-1)
+        http_requests.inc(1, request.method, route, status_code)
+        http_duration.observe(elapsed, request.method, route)
+        request_queries.observe(stats["queries"], request.method, route)
+        request_stats.reset(token)
+
+
+def render_metrics():
+    stats = cache_stats()
+    cache_hits.set(stats["hits"])
+    cache_misses.set(stats["misses"])
+
+    lines = []
+
+    for metric in registry:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
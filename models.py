@@ -1,19 +1,39 @@
-from sqlalchemy import Column, BigInteger, String, Text
-from sqlalchemy import DECIMAL, ForeignKey, Enum
+from sqlalchemy import Column, BigInteger, Integer, String, Text
+from sqlalchemy import DECIMAL, ForeignKey, Enum, Index, DateTime, func, LargeBinary
 from sqlalchemy.orm import relationship
 from database import db_base
 import enum
 
+# SQLite only autoincrements INTEGER PRIMARY KEY, so local stand-ins need this
+id_type = BigInteger().with_variant(Integer, "sqlite")
+
 
 class Collection(db_base):
     __tablename__ = "collections"
-    id = Column(BigInteger, primary_key=True, autoincrement=True, nullable=False)
+    id = Column(id_type, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String(35), nullable=False, unique=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
     products = relationship(
         "Product",
         back_populates="collection",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
+    stats = relationship(
+        "CollectionStats",
+        uselist=False,
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    # ORM flushes add "AND version = :loaded" to each UPDATE and bump it
+    __mapper_args__ = {"version_id_col": version}
 
 
 class ProductMenuEnums(enum.Enum):
@@ -23,7 +43,7 @@ class ProductMenuEnums(enum.Enum):
 
 class Product(db_base):
     __tablename__ = "products"
-    id = Column(BigInteger, primary_key=True, autoincrement=True, nullable=False)
+    id = Column(id_type, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String(35), nullable=False, unique=True)
     price = Column(DECIMAL(10, 0), nullable=False)
     description = Column(Text(), nullable=False)
@@ -33,5 +53,68 @@ class Product(db_base):
         nullable=False,
         default=ProductMenuEnums.casual,
     )
-    collection_id = Column(BigInteger, ForeignKey("collections.id"), nullable=False)
+    collection_id = Column(
+        BigInteger,
+        ForeignKey("collections.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
     collection = relationship("Collection", back_populates="products")
+
+    __table_args__ = (
+        Index("ix_products_collection_id_id", "collection_id", "id"),
+        Index("ix_products_collection_id_price_id", "collection_id", "price", "id"),
+        Index("ix_products_menu_price_id", "menu", "price", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_updated_at_id", "updated_at", "id"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+
+class CollectionStats(db_base):
+    __tablename__ = "collection_stats"
+    collection_id = Column(
+        BigInteger,
+        ForeignKey("collections.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    product_count = Column(Integer, nullable=False, default=0, server_default="0")
+    casual_count = Column(Integer, nullable=False, default=0, server_default="0")
+    special_count = Column(Integer, nullable=False, default=0, server_default="0")
+    min_price = Column(DECIMAL(10, 0), nullable=True)
+    max_price = Column(DECIMAL(10, 0), nullable=True)
+
+
+class CatalogChange(db_base):
+    __tablename__ = "catalog_changes"
+    # the primary key doubles as the feed's sequence number
+    id = Column(id_type, primary_key=True, autoincrement=True, nullable=False)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(BigInteger, nullable=False)
+    action = Column(String(10), nullable=False)
+    changed_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    )
+
+
+class IdempotencyKey(db_base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    request = Column(String(300), nullable=False)
+    # the response columns stay null while the first request is still running
+    status_code = Column(Integer, nullable=True)
+    media_type = Column(String(100), nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+    )
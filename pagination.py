@@ -0,0 +1,22 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int = 1) -> list:
+    padded = token + "=" * (-len(token) % 4)
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError("the cursor is not valid")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("the cursor is not valid")
+
+    return values
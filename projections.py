@@ -0,0 +1,56 @@
+from sqlalchemy import select, func
+from models import Collection, CollectionStats, Product
+from variants import available_variants
+
+summary_columns = (
+    Product.id,
+    Product.title,
+    Product.price,
+    Product.menu,
+    Product.collection_id,
+    Product.version,
+    Product.image_path,
+    Collection.title.label("collection_title"),
+)
+
+
+def select_products(fields: str = "full"):
+    columns = summary_columns
+
+    if fields == "full":
+        columns = columns[:3] + (Product.description,) + columns[3:]
+
+    return select(*columns).join(Collection, Product.collection_id == Collection.id)
+
+
+def product_from_row(row):
+    product = row._asdict()
+    product["menu"] = product["menu"].value
+    product["image_variants"] = available_variants(product["image_path"])
+    # keep collection_title last, matching the response schemas' field order
+    product["collection_title"] = product.pop("collection_title")
+
+    return product
+
+
+def select_collections():
+    return select(
+        Collection.id,
+        Collection.title,
+        Collection.version,
+        func.coalesce(CollectionStats.product_count, 0).label("product_count"),
+        CollectionStats.min_price,
+        CollectionStats.max_price,
+        func.coalesce(CollectionStats.casual_count, 0).label("casual_count"),
+        func.coalesce(CollectionStats.special_count, 0).label("special_count"),
+    ).outerjoin(CollectionStats, CollectionStats.collection_id == Collection.id)
+
+
+def collection_from_row(row):
+    collection = row._asdict()
+    collection["menu_counts"] = {
+        "casual": collection.pop("casual_count"),
+        "special": collection.pop("special_count"),
+    }
+
+    return collection
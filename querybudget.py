@@ -0,0 +1,103 @@
+from fastapi import Request
+from sqlalchemy import event
+from contextvars import ContextVar
+from collections import Counter
+from database import all_async_engins
+from dotenv import load_dotenv
+import logging
+import re
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "warn" logs violations, "raise" fails the request so tests catch them
+budget_mode = os.getenv("QUERY_BUDGET_MODE", "off")
+repeat_limit = int(os.getenv("QUERY_REPEAT_LIMIT", "3"))
+
+request_statements = ContextVar("request_statements", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries: int):
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+
+    return decorator
+
+
+def polling(endpoint):
+    # long-poll endpoints repeat the same query by design
+    endpoint.polling = True
+    return endpoint
+
+
+def statement_shape(statement: str):
+    shape = re.sub(r"\s+", " ", statement).strip()
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"\b\d+\b", "?", shape)
+    shape = re.sub(r"(\$\d+|%\(\w+\)s|:\w+)", "?", shape)
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", shape)
+
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements = request_statements.get()
+
+    if statements is not None:
+        statements.append(statement)
+
+
+for engine in all_async_engins:
+    event.listen(engine.sync_engine, "after_cursor_execute", record_statement)
+
+
+def find_problems(request: Request, statements: list):
+    problems = []
+    route = request.scope.get("route")
+    endpoint = getattr(route, "endpoint", None)
+    budget = getattr(endpoint, "query_budget", None)
+
+    if getattr(endpoint, "polling", False):
+        return problems
+
+    if budget is not None and len(statements) > budget:
+        problems.append(f"ran {len(statements)} queries, budget is {budget}")
+
+    shapes = Counter(statement_shape(statement) for statement in statements)
+
+    for shape, count in shapes.items():
+        if count > repeat_limit:
+            problems.append(f"possible N+1, ran {count} times: {shape}")
+
+    return problems
+
+
+async def query_budget_middleware(request: Request, call_next):
+    if budget_mode == "off":
+        return await call_next(request)
+
+    statements = []
+    token = request_statements.set(statements)
+
+    try:
+        response = await call_next(request)
+    finally:
+        request_statements.reset(token)
+
+    response.headers["X-Query-Count"] = str(len(statements))
+    problems = find_problems(request, statements)
+
+    if problems:
+        message = f"{request.method} {request.url.path}: " + "; ".join(problems)
+
+        if budget_mode == "raise":
+            raise QueryBudgetExceeded(message)
+
+        logger.warning(message)
+
+    return response
@@ -0,0 +1,255 @@
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+from collections import OrderedDict, defaultdict
+from database import TimedQueuePool
+from dotenv import load_dotenv
+import logging
+import math
+import time
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+admission_control = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "memory")
+default_rate = float(os.getenv("RATE_LIMIT_RATE", "20"))
+default_burst = int(os.getenv("RATE_LIMIT_BURST", "40"))
+max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "200"))
+max_long_lived = int(os.getenv("ADMISSION_MAX_LONG_LIVED", "1000"))
+# shed new work while pooled connections took longer than this to check out
+max_pool_wait = float(os.getenv("ADMISSION_MAX_POOL_WAIT", "0.5"))
+shed_seconds = float(os.getenv("ADMISSION_SHED_SECONDS", "1"))
+
+token_bucket_script = """
+local state = redis.call("HMGET", KEYS[1], "tokens", "at")
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def rate_limit(rate: float, burst: int, concurrency: int = None):
+    def decorator(endpoint):
+        endpoint.rate_limit = (rate, burst)
+        endpoint.max_concurrency = concurrency
+        return endpoint
+
+    return decorator
+
+
+def admission_exempt(endpoint):
+    # monitoring has to keep answering while the app is shedding load
+    endpoint.admission_exempt = True
+    return endpoint
+
+
+def long_lived(endpoint):
+    # event streams and long polls sit idle between reads without a pooled
+    # connection, so they are capped on their own instead of holding slots
+    # the catalog needs for as long as a subscriber stays connected
+    endpoint.long_lived = True
+    return endpoint
+
+
+def retry_after(tokens: float, rate: float):
+    return (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int):
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait = 0
+
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = retry_after(tokens, rate)
+
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+
+        # an evicted client simply starts again with a full bucket
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+
+        return wait
+
+
+class RedisBuckets:
+    def __init__(self, client, prefix: str = "fast-shop:rate:"):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(token_bucket_script)
+
+    async def take(self, key: str, rate: float, burst: int):
+        try:
+            allowed, tokens = await self.script(
+                keys=[self.prefix + key], args=[rate, burst, time.time()]
+            )
+        except Exception:
+            # a shared-store outage should not take the catalog down with it
+            logger.exception("rate limit store unavailable, letting request through")
+            return 0
+
+        return 0 if allowed else retry_after(float(tokens), rate)
+
+
+def build_buckets():
+    if rate_limit_backend == "none":
+        return None
+
+    if rate_limit_backend == "redis":
+        import redis.asyncio
+
+        url = os.getenv("RATE_LIMIT_URL") or os.getenv("CACHE_URL")
+        return RedisBuckets(redis.asyncio.from_url(url or "redis://localhost"))
+
+    return MemoryBuckets(int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000")))
+
+
+buckets = build_buckets()
+
+# in-flight counts guard this process's own pool, so they never leave memory
+in_flight = defaultdict(int)
+slow_checkout_at = 0.0
+
+
+def record_pool_wait(waited: float):
+    global slow_checkout_at
+
+    if waited > max_pool_wait:
+        slow_checkout_at = time.monotonic()
+
+
+TimedQueuePool.wait_listeners.append(record_pool_wait)
+
+
+def find_route(request: Request):
+    # middleware runs before routing, so find the route the way the router will
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+
+        if match == Match.FULL:
+            return route
+
+    return None
+
+
+def match_route(request: Request):
+    # the outermost middleware resolves the route once and request.state
+    # carries it to the others, instead of each one scanning every route
+    if not hasattr(request.state, "matched_route"):
+        request.state.matched_route = find_route(request)
+
+    return request.state.matched_route
+
+
+def client_address(request: Request):
+    return request.client.host if request.client else "unknown"
+
+
+def reject(status_code: int, message: str, wait: float):
+    return JSONResponse(
+        {"message": message},
+        status_code,
+        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+    )
+
+
+def release_slot(group: str, path: str):
+    in_flight[group] -= 1
+    in_flight[path] -= 1
+
+
+async def counted_body(body_iterator, group: str, path: str):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+
+    finally:
+        release_slot(group, path)
+
+
+async def admission_middleware(request: Request, call_next):
+    route = match_route(request)
+    endpoint = getattr(route, "endpoint", None)
+
+    # static files and unknown paths are cheap and never touch the database
+    if endpoint is None or getattr(endpoint, "admission_exempt", False):
+        return await call_next(request)
+
+    if not admission_control:
+        return await call_next(request)
+
+    pool_slow_for = time.monotonic() - slow_checkout_at
+
+    if pool_slow_for < shed_seconds:
+        return reject(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "the server is busy, please try again shortly",
+            shed_seconds - pool_slow_for,
+        )
+
+    if buckets is not None:
+        rate, burst = getattr(endpoint, "rate_limit", (default_rate, default_burst))
+        client = client_address(request)
+        wait = await buckets.take(f"{client}:{route.path}", rate, burst)
+
+        if wait:
+            return reject(
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                "too many requests, please slow down",
+                wait,
+            )
+
+    limit = getattr(endpoint, "max_concurrency", None)
+
+    if getattr(endpoint, "long_lived", False):
+        group, group_limit = "long_lived", max_long_lived
+    else:
+        group, group_limit = "all", max_concurrency
+
+    if in_flight[group] >= group_limit or (
+        limit is not None and in_flight[route.path] >= limit
+    ):
+        return reject(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "the server is busy, please try again shortly",
+            shed_seconds,
+        )
+
+    in_flight[group] += 1
+    in_flight[route.path] += 1
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release_slot(group, route.path)
+        raise
+
+    # call_next returns once the headers are out, so exports and event
+    # streams only give their slot back when the body is done
+    response.body_iterator = counted_body(
+        response.body_iterator, group, route.path
+    )
+    return response
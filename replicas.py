@@ -0,0 +1,63 @@
+from fastapi import Request
+from database import replica_urls
+import cache
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# seconds a client keeps reading from the primary after it writes; 0 disables
+read_your_writes_seconds = int(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+wrote_cookie = "fast-shop-wrote"
+read_methods = ("GET", "HEAD", "OPTIONS")
+
+if replica_urls:
+    cache.repeat_invalidation_seconds = read_your_writes_seconds
+
+
+def read_only(endpoint):
+    # for POST endpoints that only read, such as long id lists in a body
+    endpoint.read_only = True
+    return endpoint
+
+
+def is_write(request: Request):
+    if request.method in read_methods:
+        return False
+
+    route = request.scope.get("route")
+    return not getattr(getattr(route, "endpoint", None), "read_only", False)
+
+
+def skips_cache(request: Request):
+    # entries may have been refilled from a replica that has not seen this
+    # client's write yet, so the writer reads around the cache in its window
+    return bool(replica_urls) and request.cookies.get(wrote_cookie) is not None
+
+
+def reads_from_primary(request: Request):
+    if not replica_urls:
+        return True
+
+    return request.cookies.get(wrote_cookie) is not None
+
+
+async def read_your_writes_middleware(request: Request, call_next):
+    response = await call_next(request)
+
+    if (
+        replica_urls
+        and read_your_writes_seconds
+        and response.status_code < 400
+        and is_write(request)
+    ):
+        # the cookie expiring is what ends the window, so no clock is stored
+        response.set_cookie(
+            wrote_cookie,
+            "1",
+            max_age=read_your_writes_seconds,
+            httponly=True,
+            samesite="lax",
+        )
+
+    return response
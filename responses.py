@@ -0,0 +1,46 @@
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+from decimal import Decimal
+import enum
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+json_encoder = os.getenv("JSON_ENCODER", "orjson" if orjson else "json")
+validate_responses = os.getenv("VALIDATE_RESPONSES", "false").lower() == "true"
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        # prices are DECIMAL(10, 0); never round-trip them through float
+        if value == value.to_integral_value():
+            return int(value)
+        return str(value)
+
+    if isinstance(value, enum.Enum):
+        return value.value
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if json_encoder == "orjson":
+        return orjson.dumps(content, default=encode_default)
+
+    return json.dumps(
+        content,
+        default=encode_default,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
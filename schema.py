@@ -1,12 +1,15 @@
-from typing import Optional
-from pydantic import BaseModel, field_validator, PositiveInt
-from dependencies import get_db_python
-from models import Collection, Product
+from typing import Optional, Union
+from pydantic import BaseModel, Field, field_validator, PositiveInt
 
 
 class BaseGetCollectionsSchema(BaseModel):
     id: int
     title: str
+    version: int = 1
+    product_count: int = 0
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    menu_counts: dict[str, int] = {}
 
 
 class GetCollectionSchema(BaseGetCollectionsSchema):
@@ -22,8 +25,16 @@ class GetAllCollectionsSchema(BaseModel):
     items: list[BaseGetCollectionsSchema]
 
 
+class CursorCollectionsSchema(BaseModel):
+    per_page: int
+    total_items: Optional[int] = None
+    has_next: bool
+    next_cursor: Optional[str] = None
+    items: list[BaseGetCollectionsSchema]
+
+
 class CreateCollectionSchema(BaseModel):
-    title: str
+    title: str = Field(max_length=35)
 
     @field_validator("title")
     def title_validator(cls, value: str):
@@ -33,19 +44,11 @@ class CreateCollectionSchema(BaseModel):
         if not value.isalnum():
             raise ValueError("please inter a valid title")
 
-        with get_db_python() as db:
-            unique_title = (
-                db.query(Collection).filter(Collection.title == value).first()
-            )
-
-            if unique_title:
-                raise ValueError("we already have this collection in our DataBase")
-
         return value
 
 
 class UpdateCollectionSchema(BaseModel):
-    title: Optional[str] = None
+    title: Optional[str] = Field(None, max_length=35)
 
     @field_validator("title")
     def title_validator(cls, value: str):
@@ -55,14 +58,6 @@ class UpdateCollectionSchema(BaseModel):
         if not value.isalnum():
             raise ValueError("please inter a valid title")
 
-        with get_db_python() as db:
-            unique_title = (
-                db.query(Collection).filter(Collection.title == value).first()
-            )
-
-            if unique_title:
-                raise ValueError("we already have this collection in our DataBase")
-
         return value
 
 
@@ -77,7 +72,21 @@ class BaseProductSchema(BaseModel):
     description: str
     menu: str
     collection_id: int
+    version: int = 1
     image_path: str
+    image_variants: dict[str, str] = {}
+    collection_title: str
+
+
+class ProductSummarySchema(BaseModel):
+    id: int
+    title: str
+    price: PositiveInt
+    menu: str
+    collection_id: int
+    version: int = 1
+    image_path: str
+    image_variants: dict[str, str] = {}
     collection_title: str
 
 
@@ -91,11 +100,65 @@ class GetAllProductsSchema(BaseModel):
     total_items: int
     has_next: bool
     has_previous: bool
+    items: list[Union[BaseProductSchema, ProductSummarySchema]]
+
+
+class CursorProductsSchema(BaseModel):
+    per_page: int
+    total_items: Optional[int] = None
+    has_next: bool
+    next_cursor: Optional[str] = None
+    items: list[Union[BaseProductSchema, ProductSummarySchema]]
+
+
+class BatchProductSchema(BaseModel):
+    id: int
+    found: bool
+    product: Optional[BaseProductSchema] = None
+
+
+class BatchProductsSchema(BaseModel):
+    items: list[BatchProductSchema]
+
+
+class BatchProductsRequestSchema(BaseModel):
+    ids: list[int]
+
+    @field_validator("ids")
+    def ids_validator(cls, value: list):
+        if not value:
+            raise ValueError("at least one product id is required")
+
+        if len(value) > 1000:
+            raise ValueError("at most 1000 product ids can be requested at once")
+
+        return value
+
+
+class SearchProductsSchema(BaseModel):
+    query: str
+    page: int
+    per_page: int
+    has_next: bool
+    has_previous: bool
     items: list[BaseProductSchema]
 
 
+class ChangeSchema(BaseModel):
+    seq: int
+    entity: str
+    entity_id: int
+    action: str
+    changed_at: str
+
+
+class ChangesSchema(BaseModel):
+    next_after: int
+    changes: list[ChangeSchema]
+
+
 class CreateProductSchema(BaseModel):
-    title: str
+    title: str = Field(max_length=35)
     price: PositiveInt
     description: str
     menu: str
@@ -106,12 +169,6 @@ class CreateProductSchema(BaseModel):
         if not value.isalnum():
             raise ValueError("please inter a valid title")
 
-        with get_db_python() as db:
-            unique_title = db.query(Product).filter(Product.title == value).first()
-
-            if unique_title:
-                raise ValueError("we already have this product in our DataBase")
-
         return value
 
     @field_validator("price")
@@ -129,20 +186,9 @@ class CreateProductSchema(BaseModel):
             raise ValueError("the menu choices are special and casual")
         return value
 
-    @field_validator("collection_id")
-    def collection_id_validator(cls, value: int):
-        with get_db_python() as db:
-            exist_collection = (
-                db.query(Collection).filter(Collection.id == value).first()
-            )
-
-            if not exist_collection:
-                raise ValueError("we do not have this collection in our DataBase")
-        return value
-
 
 class UpdateProductSchema(BaseModel):
-    title: Optional[str] = None
+    title: Optional[str] = Field(None, max_length=35)
     price: Optional[PositiveInt] = None
     description: Optional[str] = None
     menu: Optional[str] = None
@@ -156,12 +202,6 @@ class UpdateProductSchema(BaseModel):
         if not value.isalnum():
             raise ValueError("please inter a valid title")
 
-        with get_db_python() as db:
-            unique_title = db.query(Product).filter(Product.title == value).first()
-
-            if unique_title:
-                raise ValueError("we already have this product in our DataBase")
-
         return value
 
     @field_validator("price")
@@ -184,15 +224,29 @@ class UpdateProductSchema(BaseModel):
             raise ValueError("the menu choices are special and casual")
         return value
 
-    @field_validator("collection_id")
-    def collection_id_validator(cls, value: int):
-        if value is None:
-            return value
 
-        with get_db_python() as db:
-            exist_collection = db.query(Product).filter(Product.id == value).first()
+class BatchUpdateProductSchema(UpdateProductSchema):
+    id: int
+    version: Optional[int] = None
+
+
+class BatchUpdateProductsSchema(BaseModel):
+    items: list[BatchUpdateProductSchema]
+
+    @field_validator("items")
+    def items_validator(cls, value: list):
+        if not value:
+            raise ValueError("at least one product update is required")
+
+        if len(value) > 500:
+            raise ValueError("at most 500 products can be updated at once")
+
+        if len({item.id for item in value}) != len(value):
+            raise ValueError("each product can only appear once in a batch")
+
+        titles = [item.title for item in value if item.title is not None]
 
-            if not exist_collection:
-                raise ValueError("we do not have this collection in our DataBase")
+        if len(set(titles)) != len(titles):
+            raise ValueError("two products in a batch can not get the same title")
 
         return value
@@ -0,0 +1,67 @@
+from sqlalchemy import func, or_, case, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product
+from projections import select_products
+from filters import filter_products
+
+search_config = literal_column("'simple'::regconfig")
+
+
+def search_document():
+    # must match the ix_products_search expression index from alembic
+    return func.to_tsvector(
+        search_config, Product.title + literal_column("' '") + Product.description
+    )
+
+
+def postgres_search(query, text: str):
+    document = search_document()
+    terms = func.websearch_to_tsquery(search_config, text)
+    rank = func.ts_rank_cd(document, terms)
+
+    return query.where(document.op("@@")(terms)).order_by(rank.desc(), Product.id)
+
+
+def contains(column, word: str):
+    # the user's words are matched literally, so q=% does not match everything
+    for character in ("\\", "%", "_"):
+        word = word.replace(character, f"\\{character}")
+
+    return column.ilike(f"%{word}%", escape="\\")
+
+
+def fallback_search(query, text: str):
+    words = text.split()
+
+    for word in words:
+        query = query.where(
+            or_(contains(Product.title, word), contains(Product.description, word))
+        )
+
+    title_hits = sum(
+        case((contains(Product.title, word), 1), else_=0) for word in words
+    )
+
+    return query.order_by(title_hits.desc(), Product.id)
+
+
+async def search_products(
+    db: AsyncSession,
+    text: str,
+    menu: str = None,
+    collection_id: int = None,
+    min_price: int = None,
+    max_price: int = None,
+    offset: int = 0,
+    limit: int = 20,
+):
+    query = select_products()
+    query = filter_products(query, menu, collection_id, min_price, max_price)
+
+    if db.get_bind().dialect.name == "postgresql":
+        query = postgres_search(query, text)
+    else:
+        query = fallback_search(query, text)
+
+    result = await db.execute(query.offset(offset).limit(limit))
+    return result.all()
@@ -0,0 +1,61 @@
+from dotenv import load_dotenv
+import logging
+import uvicorn
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+default_workers = str(os.cpu_count() or 1)
+
+
+def optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def server_settings():
+    reload = os.getenv("SERVER_RELOAD", "false").lower() == "true"
+
+    return {
+        "host": os.getenv("SERVER_HOST", "127.0.0.1"),
+        "port": int(os.getenv("SERVER_PORT", "8000")),
+        # uvicorn can only reload a single process
+        "workers": 1 if reload else int(os.getenv("SERVER_WORKERS", default_workers)),
+        "reload": reload,
+        "limit_concurrency": optional_int("SERVER_LIMIT_CONCURRENCY"),
+        "limit_max_requests": optional_int("SERVER_MAX_REQUESTS"),
+        "backlog": int(os.getenv("SERVER_BACKLOG", "2048")),
+        "timeout_keep_alive": int(os.getenv("SERVER_KEEP_ALIVE", "5")),
+        "timeout_graceful_shutdown": optional_int("SERVER_GRACEFUL_TIMEOUT"),
+        "proxy_headers": os.getenv("SERVER_PROXY_HEADERS", "true").lower() == "true",
+        "access_log": os.getenv("SERVER_ACCESS_LOG", "false").lower() == "true",
+    }
+
+
+def shared_cache_backend(workers: int):
+    # the memory cache only invalidates the worker that handled the write, so
+    # the others would serve stale payloads until CACHE_TTL runs out
+    backend = os.getenv("CACHE_BACKEND", "memory")
+
+    if workers > 1 and backend == "memory":
+        logger.warning(
+            "CACHE_BACKEND=memory can not be shared by %s workers, "
+            "running without a cache; set CACHE_BACKEND=redis to keep one",
+            workers,
+        )
+        return "none"
+
+    return backend
+
+
+def main():
+    settings = server_settings()
+    # workers are spawned with this environment, so they all build the same one
+    os.environ["CACHE_BACKEND"] = shared_cache_backend(settings["workers"])
+    uvicorn.run("main:app", lifespan="on", **settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+from sqlalchemy import select, update, insert, func, case, bindparam, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Collection, CollectionStats, Product, ProductMenuEnums
+from collections import defaultdict
+
+stats_table = CollectionStats.__table__
+
+menu_columns = {
+    ProductMenuEnums.casual: "casual",
+    ProductMenuEnums.special: "special",
+}
+
+
+product_fact_fields = {"collection_id", "price", "menu"}
+
+
+def product_facts(collection_id: int, price, menu):
+    # the (collection_id, price, menu) triple is all the stats depend on
+    return (collection_id, price, ProductMenuEnums(menu))
+
+
+def group_changes(removed, added):
+    changes = defaultdict(
+        lambda: {
+            "count": 0,
+            "casual": 0,
+            "special": 0,
+            "low": None,
+            "high": None,
+            "shrunk": False,
+        }
+    )
+
+    for collection_id, price, menu in removed:
+        change = changes[collection_id]
+        change["count"] -= 1
+        change[menu_columns[menu]] -= 1
+        change["shrunk"] = True
+
+    for collection_id, price, menu in added:
+        change = changes[collection_id]
+        change["count"] += 1
+        change[menu_columns[menu]] += 1
+        change["low"] = price if change["low"] is None else min(change["low"], price)
+        change["high"] = price if change["high"] is None else max(change["high"], price)
+
+    return changes
+
+
+def delta(name: str):
+    return bindparam(f"delta_{name}", type_=Integer)
+
+
+def counter_values():
+    columns = stats_table.c
+
+    return {
+        "product_count": columns.product_count + delta("count"),
+        "casual_count": columns.casual_count + delta("casual"),
+        "special_count": columns.special_count + delta("special"),
+    }
+
+
+def grow_statement():
+    low = bindparam("new_low", type_=stats_table.c.min_price.type)
+    high = bindparam("new_high", type_=stats_table.c.max_price.type)
+    min_price, max_price = stats_table.c.min_price, stats_table.c.max_price
+
+    return (
+        update(stats_table)
+        .where(stats_table.c.collection_id == bindparam("stats_collection_id"))
+        .values(
+            **counter_values(),
+            min_price=case(
+                (min_price.is_(None), low),
+                (low < min_price, low),
+                else_=min_price,
+            ),
+            max_price=case(
+                (max_price.is_(None), high),
+                (high > max_price, high),
+                else_=max_price,
+            ),
+        )
+    )
+
+
+def shrink_statement():
+    # a removed product may have held the min or max, so those are re-read
+    # from the (collection_id, price, id) index instead of adjusted in place
+    prices = select(Product.price).where(
+        Product.collection_id == stats_table.c.collection_id
+    )
+
+    return (
+        update(stats_table)
+        .where(stats_table.c.collection_id == bindparam("stats_collection_id"))
+        .values(
+            **counter_values(),
+            min_price=prices.with_only_columns(func.min(Product.price))
+            .scalar_subquery(),
+            max_price=prices.with_only_columns(func.max(Product.price))
+            .scalar_subquery(),
+        )
+    )
+
+
+async def apply_product_changes(db: AsyncSession, removed=(), added=()):
+    # removed products must be flushed first so the min/max re-read skips them;
+    # every touched collection is covered by at most two executemany statements
+    grown, shrunk = [], []
+
+    for collection_id, change in group_changes(removed, added).items():
+        params = {
+            "stats_collection_id": collection_id,
+            "delta_count": change["count"],
+            "delta_casual": change["casual"],
+            "delta_special": change["special"],
+        }
+
+        if change["shrunk"]:
+            shrunk.append(params)
+        else:
+            grown.append(
+                {**params, "new_low": change["low"], "new_high": change["high"]}
+            )
+
+    if grown:
+        await db.execute(grow_statement(), grown)
+
+    if shrunk:
+        # on READ COMMITTED the min/max subquery would use the snapshot taken
+        # before waiting on a concurrent writer's row lock and miss its
+        # product for good; taking the locks first makes the UPDATE start
+        # with a snapshot that includes it
+        await db.execute(
+            select(stats_table.c.collection_id)
+            .where(
+                stats_table.c.collection_id.in_(
+                    [params["stats_collection_id"] for params in shrunk]
+                )
+            )
+            .order_by(stats_table.c.collection_id)
+            .with_for_update()
+        )
+        await db.execute(shrink_statement(), shrunk)
+
+
+async def create_stats(db: AsyncSession, titles: list):
+    await db.execute(
+        insert(CollectionStats).from_select(
+            ["collection_id"],
+            select(Collection.id).where(Collection.title.in_(titles)),
+        )
+    )
+
@@ -0,0 +1,200 @@
+from fastapi import UploadFile, Request, status
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from database import async_local_session
+from models import Product
+from variants import variant_paths
+from ratelimit import match_route
+from dotenv import load_dotenv
+import tempfile
+import hashlib
+import asyncio
+import logging
+import time
+import re
+import os
+
+load_dotenv()
+
+images_dir = "static/images"
+chunk_size = 64 * 1024
+max_image_size = int(os.getenv("MAX_IMAGE_SIZE", str(5 * 1024 * 1024)))
+# room for the other form fields and multipart framing around the image
+form_overhead = 64 * 1024
+# files this fresh may belong to an upload whose product is not committed yet
+gc_grace_seconds = int(os.getenv("IMAGE_GC_GRACE_SECONDS", "3600"))
+# how often each worker sweeps images/ for files no product points at; 0 disables
+gc_interval_seconds = int(os.getenv("IMAGE_GC_INTERVAL_SECONDS", "3600"))
+
+logger = logging.getLogger(__name__)
+
+
+# write_image only ever produces <sha256><extension> directly in images_dir
+stored_name = re.compile(r"[0-9a-f]{64}(\.[a-z0-9]{1,5})?")
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def image_upload(endpoint):
+    endpoint.image_upload = True
+    return endpoint
+
+
+async def upload_size_middleware(request: Request, call_next):
+    # the multipart body is spooled to disk before the handler runs, so an
+    # oversized upload has to be turned away on its declared length instead
+    length = request.headers.get("content-length")
+    endpoint = getattr(match_route(request), "endpoint", None)
+
+    if (
+        getattr(endpoint, "image_upload", False)
+        and length is not None
+        and length.isdigit()
+        and int(length) > max_image_size + form_overhead
+    ):
+        return JSONResponse(
+            {
+                "error": f"the image must be at most {max_image_size} bytes",
+                "field": "product_image",
+                "input": None,
+            },
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    return await call_next(request)
+
+
+def image_extension(filename: str):
+    extension = os.path.splitext(filename or "")[1].lower()
+
+    if re.fullmatch(r"\.[a-z0-9]{1,5}", extension):
+        return extension
+
+    return ""
+
+
+def write_image(source, extension: str, max_size: int):
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, temp_path = tempfile.mkstemp(dir=images_dir, suffix=".part")
+
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while chunk := source.read(chunk_size):
+                size += len(chunk)
+
+                if size > max_size:
+                    raise ImageTooLarge(f"the image must be at most {max_size} bytes")
+
+                digest.update(chunk)
+                buffer.write(chunk)
+
+        image_path = f"{images_dir}/{digest.hexdigest()}{extension}"
+        # identical uploads hash to the same name, so replacing is a no-op
+        os.replace(temp_path, image_path)
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return image_path
+
+
+async def save_image(upload: UploadFile, max_size: int = None):
+    extension = image_extension(upload.filename)
+    max_size = max_size or max_image_size
+    return await run_in_threadpool(write_image, upload.file, extension, max_size)
+
+
+def is_stored_image(image_path: str):
+    # image_path comes from the database, so never trust it to stay inside
+    # the static tree; anything we did not write ourselves is left alone
+    real_path = os.path.realpath(image_path)
+
+    if os.path.dirname(real_path) != os.path.realpath(images_dir):
+        return False
+
+    return stored_name.fullmatch(os.path.basename(real_path)) is not None
+
+
+def remove_images(image_paths: list):
+    cutoff = time.time() - gc_grace_seconds
+    removed = 0
+
+    for image_path in image_paths:
+        if not is_stored_image(image_path):
+            logger.warning("not removing %s, it is not a stored image", image_path)
+            continue
+
+        try:
+            if os.path.getmtime(image_path) > cutoff:
+                continue
+
+            os.remove(image_path)
+            removed += 1
+
+        except FileNotFoundError:
+            continue
+
+        for variant_path in variant_paths(image_path).values():
+            if os.path.exists(variant_path):
+                os.remove(variant_path)
+
+    return removed
+
+
+def stored_images():
+    return [
+        f"{images_dir}/{entry.name}"
+        for entry in os.scandir(images_dir)
+        if entry.is_file() and not entry.name.endswith(".part")
+    ]
+
+
+async def remove_unreferenced_images(image_paths: list):
+    candidates = {path for path in image_paths if path}
+
+    if not candidates:
+        return 0
+
+    async with async_local_session() as db:
+        result = await db.execute(
+            select(Product.image_path)
+            .where(Product.image_path.in_(candidates))
+            .distinct()
+        )
+        referenced = set(result.scalars())
+
+    orphans = sorted(candidates - referenced)
+    removed = await run_in_threadpool(remove_images, orphans)
+
+    if removed:
+        logger.info("removed %s unreferenced images", removed)
+
+    return removed
+
+
+async def collect_orphan_images():
+    image_paths = await run_in_threadpool(stored_images)
+    removed = 0
+
+    for start in range(0, len(image_paths), 1000):
+        removed += await remove_unreferenced_images(image_paths[start : start + 1000])
+
+    return removed
+
+
+async def sweep_orphan_images():
+    while True:
+        await asyncio.sleep(gc_interval_seconds)
+
+        try:
+            await collect_orphan_images()
+        except Exception:
+            # a failed sweep only means the files wait for the next one
+            logger.exception("could not collect orphaned images")
@@ -0,0 +1,101 @@
+import tempfile
+import sys
+import os
+
+# the app reads its settings at import time, so they are pinned before any
+# test module imports it; budgets are enforced and the cache is off so every
+# read really reaches the database
+work_dir = tempfile.mkdtemp(prefix="fast-shop-tests-")
+os.environ.update(
+    {
+        "DATABASE_URL": f"sqlite:///{work_dir}/test.db",
+        "QUERY_BUDGET_MODE": "raise",
+        "CACHE_BACKEND": "none",
+        "RATE_LIMIT_BACKEND": "none",
+        "ADMISSION_CONTROL": "false",
+        "READ_REPLICA_URLS": "",
+        "IMAGE_GC_INTERVAL_SECONDS": "0",
+        "CHANGE_GAP_SECONDS": "0",
+    }
+)
+os.chdir(work_dir)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from database import engin, db_base  # noqa: E402
+import models  # noqa: E402, F401
+import pytest  # noqa: E402
+
+
+def product_form(title: str, collection_id: int, price: int = 10, menu: str = "casual"):
+    return {
+        "title": title,
+        "price": price,
+        "description": f"{title} description",
+        "menu": menu,
+        "collection_id": collection_id,
+    }
+
+
+def image_file(name: str = "image.png"):
+    return {"product_image": (name, name.encode(), "image/png")}
+
+
+@pytest.fixture(scope="session")
+def client():
+    db_base.metadata.drop_all(engin)
+    db_base.metadata.create_all(engin)
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def catalog(client):
+    # two collections with a few products each, shared by the read tests
+    collection_ids = []
+
+    for title in ("shoes", "hats"):
+        client.post("/create-collection", json={"title": title})
+
+    for item in client.get("/get-all-collections").json()["items"]:
+        collection_ids.append(item["id"])
+
+    for number in range(6):
+        collection_id = collection_ids[number % 2]
+        client.post(
+            "/create-product",
+            data=product_form(f"item{number}", collection_id, price=10 + number),
+            files=image_file(f"item{number}.png"),
+        )
+
+    product_ids = [
+        item["id"] for item in client.get("/get-all-products").json()["items"]
+    ]
+
+    return {"collections": collection_ids, "products": product_ids}
+
+
+def new_collection(client, title: str):
+    client.post("/create-collection", json={"title": title})
+    page = 1
+
+    while True:
+        result = client.get(f"/get-all-collections?page={page}&per_page=20").json()
+
+        for item in result["items"]:
+            if item["title"] == title:
+                return item["id"]
+
+        if not result["has_next"]:
+            raise LookupError(title)
+
+        page += 1
+
+
+def collection_products(client, collection_id: int):
+    return client.get(
+        f"/get-all-products?collection_id={collection_id}&per_page=20"
+    ).json()["items"]
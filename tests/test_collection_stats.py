@@ -0,0 +1,100 @@
+from conftest import product_form, image_file, new_collection, collection_products
+
+
+def assert_stats_match(client, collection_id: int):
+    # the stored counters must always equal a recount of the products
+    collection = client.get(f"/get-collection/{collection_id}").json()
+    products = collection_products(client, collection_id)
+    prices = [product["price"] for product in products]
+
+    assert collection["product_count"] == len(products)
+    assert collection["min_price"] == (min(prices) if prices else None)
+    assert collection["max_price"] == (max(prices) if prices else None)
+    assert collection["menu_counts"] == {
+        menu: sum(product["menu"] == menu for product in products)
+        for menu in ("casual", "special")
+    }
+
+
+def add_product(client, title: str, collection_id: int, price: int, menu: str):
+    response = client.post(
+        "/create-product",
+        data=product_form(title, collection_id, price=price, menu=menu),
+        files=image_file(f"{title}.png"),
+    )
+    assert response.status_code < 300, response.text
+
+    return next(
+        product["id"]
+        for product in collection_products(client, collection_id)
+        if product["title"] == title
+    )
+
+
+def test_new_collection_has_empty_stats(client):
+    collection_id = new_collection(client, "statsempty")
+    collection = client.get(f"/get-collection/{collection_id}").json()
+
+    assert collection["product_count"] == 0
+    assert collection["min_price"] is None
+    assert collection["menu_counts"] == {"casual": 0, "special": 0}
+
+
+def test_stats_follow_creates_and_updates(client):
+    first = new_collection(client, "statsfirst")
+    second = new_collection(client, "statssecond")
+
+    cheap = add_product(client, "statscheap", first, 5, "casual")
+    add_product(client, "statsmiddle", first, 20, "special")
+    add_product(client, "statsdear", second, 90, "casual")
+    assert_stats_match(client, first)
+    assert_stats_match(client, second)
+
+    # moving the cheapest product away has to re-read the minimum
+    response = client.patch(f"/update-product/{cheap}", data={"collection_id": second})
+    assert response.status_code == 202, response.text
+    assert_stats_match(client, first)
+    assert_stats_match(client, second)
+
+    response = client.patch(f"/update-product/{cheap}", data={"price": 200, "menu": "special"})
+    assert response.status_code == 202, response.text
+    assert_stats_match(client, second)
+
+    # title only edits leave the stats alone
+    response = client.patch(f"/update-product/{cheap}", data={"title": "statsrenamed"})
+    assert response.status_code == 202, response.text
+    assert_stats_match(client, second)
+
+
+def test_stats_follow_batch_updates(client):
+    first = new_collection(client, "statsbatchone")
+    second = new_collection(client, "statsbatchtwo")
+    low = add_product(client, "statsbatchlow", first, 1, "casual")
+    high = add_product(client, "statsbatchhigh", first, 100, "casual")
+    other = add_product(client, "statsbatchother", second, 50, "special")
+
+    response = client.patch(
+        "/update-products",
+        json={
+            "items": [
+                {"id": low, "collection_id": second},
+                {"id": high, "price": 60, "menu": "special"},
+                {"id": other, "price": 10},
+            ]
+        },
+    )
+
+    assert response.status_code == 202, response.text
+    assert_stats_match(client, first)
+    assert_stats_match(client, second)
+
+
+def test_stats_go_with_the_deleted_collection(client):
+    collection_id = new_collection(client, "statsdeleted")
+    add_product(client, "statsdoomed", collection_id, 30, "casual")
+    assert_stats_match(client, collection_id)
+
+    response = client.delete(f"/delete-collection/{collection_id}")
+
+    assert response.status_code == 202
+    assert client.get(f"/get-collection/{collection_id}").status_code == 404
@@ -0,0 +1,55 @@
+def import_collections(client, name: str, content: bytes):
+    response = client.post(
+        "/import-collections", files={"catalog_file": (name, content, "text/plain")}
+    )
+    assert response.status_code == 200, response.text
+
+    return response.json()
+
+
+def test_csv_rows_with_extra_fields_fail_alone(client):
+    report = import_collections(
+        client, "rows.csv", b"title\nimportcsvone\nimportcsvtwo,surplus\n"
+    )
+
+    assert report["inserted"] == 1
+    assert report["errors"] == [
+        {
+            "row": 2,
+            "error": "the row has more fields than the header",
+            "field": None,
+            "input": {"title": "importcsvtwo"},
+        }
+    ]
+
+
+def test_undecodable_lines_fail_alone(client):
+    content = b'{"title": "importutfone"}\n{"title": "import\xffbad"}\n'
+    report = import_collections(client, "rows.ndjson", content)
+
+    assert report["inserted"] == 1
+    assert report["errors"][0]["row"] == 2
+    assert report["errors"][0]["error"] == "the row is not valid utf-8"
+    assert report["errors"][0]["input"] == '{"title": "import�bad"}'
+
+    report = import_collections(client, "rows.csv", b"title\nimport\xfeutf\n")
+
+    assert report["inserted"] == 0
+    assert report["errors"][0]["error"] == "the row is not valid utf-8"
+
+
+def test_imported_products_without_image(client, catalog):
+    content = (
+        '{"title": "importbare", "price": 5, "description": "bare", '
+        f'"menu": "casual", "collection_id": {catalog["collections"][0]}}}\n'
+    )
+    response = client.post(
+        "/import-products",
+        files={"catalog_file": ("rows.ndjson", content.encode(), "text/plain")},
+    )
+    assert response.json()["inserted"] == 1
+
+    items = client.get("/search-products?q=importbare").json()["items"]
+
+    assert items[0]["image_path"] == ""
+    assert items[0]["image_variants"] == {}
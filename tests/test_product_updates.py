@@ -0,0 +1,153 @@
+from conftest import product_form, image_file, new_collection, collection_products
+
+
+def make_products(client, prefix: str, count: int):
+    collection_id = new_collection(client, f"{prefix}collection")
+
+    for number in range(count):
+        client.post(
+            "/create-product",
+            data=product_form(f"{prefix}{number}", collection_id, price=10 + number),
+            files=image_file(f"{prefix}{number}.png"),
+        )
+
+    return collection_id, collection_products(client, collection_id)
+
+
+def test_update_keeps_untouched_fields(client):
+    collection_id, [product] = make_products(client, "single", 1)
+
+    response = client.patch(
+        f"/update-product/{product['id']}", data={"description": "rewritten"}
+    )
+    updated = client.get(f"/get-product/{product['id']}").json()
+
+    assert response.status_code == 202
+    assert updated["description"] == "rewritten"
+    assert updated["title"] == product["title"]
+    assert updated["price"] == product["price"]
+    assert updated["version"] == product["version"] + 1
+
+
+def test_update_missing_product(client):
+    response = client.patch("/update-product/999999", data={"title": "ghost"})
+
+    assert response.status_code == 404
+    assert "message" in response.json()
+
+
+def test_update_to_missing_collection(client):
+    collection_id, [product] = make_products(client, "lost", 1)
+
+    response = client.patch(
+        f"/update-product/{product['id']}", data={"collection_id": 999999}
+    )
+
+    assert response.json()["field"] == "collection_id"
+    assert client.get(f"/get-product/{product['id']}").json()["collection_id"] == (
+        collection_id
+    )
+
+
+def test_batch_update(client):
+    collection_id, products = make_products(client, "batch", 3)
+    items = [
+        {"id": product["id"], "price": 100 + number, "version": product["version"]}
+        for number, product in enumerate(products)
+    ]
+    items[0]["title"] = "batchrenamed"
+
+    response = client.patch("/update-products", json={"items": items})
+
+    assert response.status_code == 202
+    assert response.json()["items"] == [
+        {"id": product["id"], "version": product["version"] + 1}
+        for product in products
+    ]
+
+    updated = {item["id"]: item for item in collection_products(client, collection_id)}
+    assert updated[products[0]["id"]]["title"] == "batchrenamed"
+    assert [updated[product["id"]]["price"] for product in products] == [100, 101, 102]
+
+
+def test_batch_update_missing_products(client):
+    collection_id, products = make_products(client, "batchmissing", 1)
+
+    response = client.patch(
+        "/update-products",
+        json={"items": [{"id": products[0]["id"], "price": 1}, {"id": 999999}]},
+    )
+
+    assert response.status_code == 404
+    assert response.json()["ids"] == [999999]
+    assert collection_products(client, collection_id)[0]["price"] == 10
+
+
+def test_batch_update_stale_version(client):
+    collection_id, products = make_products(client, "batchstale", 2)
+
+    response = client.patch(
+        "/update-products",
+        json={
+            "items": [
+                {"id": products[0]["id"], "price": 1, "version": products[0]["version"]},
+                {"id": products[1]["id"], "price": 1, "version": 0},
+            ]
+        },
+    )
+
+    assert response.status_code == 412
+    assert response.json()["id"] == products[1]["id"]
+    assert {item["price"] for item in collection_products(client, collection_id)} == {
+        10,
+        11,
+    }
+
+
+def test_batch_update_missing_collection(client):
+    collection_id, products = make_products(client, "batchorphan", 2)
+
+    response = client.patch(
+        "/update-products",
+        json={
+            "items": [
+                {"id": products[0]["id"], "price": 1},
+                {"id": products[1]["id"], "collection_id": 999999},
+            ]
+        },
+    )
+
+    assert response.json() == {
+        "error": response.json()["error"],
+        "field": "collection_id",
+        "input": 999999,
+    }
+    assert len(collection_products(client, collection_id)) == 2
+    assert collection_products(client, collection_id)[0]["price"] == 10
+
+
+def test_batch_update_duplicate_title(client):
+    collection_id, products = make_products(client, "batchclash", 2)
+
+    response = client.patch(
+        "/update-products",
+        json={"items": [{"id": products[0]["id"], "title": products[1]["title"]}]},
+    )
+
+    assert response.json()["field"] == "title"
+    assert collection_products(client, collection_id)[0]["title"] == (
+        products[0]["title"]
+    )
+
+    # two rows of one batch asking for the same title never reach the database
+    response = client.patch(
+        "/update-products",
+        json={
+            "items": [
+                {"id": products[0]["id"], "title": "batchsame"},
+                {"id": products[1]["id"], "title": "batchsame"},
+            ]
+        },
+    )
+
+    assert response.status_code == 400
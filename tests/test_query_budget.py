@@ -0,0 +1,128 @@
+from conftest import product_form, image_file
+import pytest
+
+
+def get_collection(client, catalog):
+    return client.get(f"/get-collection/{catalog['collections'][0]}")
+
+
+def get_all_collections(client, catalog):
+    client.get("/get-all-collections?page=1&per_page=1")
+    return client.get("/get-all-collections?cursor=true&per_page=1")
+
+
+def create_collection(client, catalog):
+    return client.post("/create-collection", json={"title": "budgetcreate"})
+
+
+def update_collection(client, catalog):
+    client.post("/create-collection", json={"title": "budgetrename"})
+    collection_id = client.get("/get-all-collections?per_page=20").json()["items"][-1]["id"]
+    return client.patch(
+        f"/update-collection/{collection_id}", data={"title": "budgetrenamed"}
+    )
+
+
+def delete_collection(client, catalog):
+    client.post("/create-collection", json={"title": "budgetdelete"})
+    collection_id = client.get("/get-all-collections?per_page=20").json()["items"][-1]["id"]
+    client.post(
+        "/create-product",
+        data=product_form("budgetdeleted", collection_id),
+        files=image_file("budgetdeleted.png"),
+    )
+    return client.delete(f"/delete-collection/{collection_id}")
+
+
+def get_product(client, catalog):
+    return client.get(f"/get-product/{catalog['products'][0]}")
+
+
+def get_products(client, catalog):
+    ids = ",".join(str(product_id) for product_id in catalog["products"])
+    return client.get(f"/get-products?ids={ids},999999")
+
+
+def post_get_products(client, catalog):
+    return client.post("/get-products", json={"ids": catalog["products"]})
+
+
+def get_all_products(client, catalog):
+    collection_id = catalog["collections"][0]
+    client.get("/get-all-products?page=2&per_page=2&sort_by=price&order=desc")
+    client.get(f"/get-all-products?collection_id={collection_id}&menu=casual")
+    return client.get("/get-all-products?cursor=true&per_page=2&with_total=true")
+
+
+def search_products(client, catalog):
+    return client.get("/search-products?q=item&per_page=5")
+
+
+def create_product(client, catalog):
+    return client.post(
+        "/create-product",
+        data=product_form("budgetproduct", catalog["collections"][0]),
+        files=image_file("budgetproduct.png"),
+    )
+
+
+def update_product(client, catalog):
+    product_id = catalog["products"][1]
+    client.patch(f"/update-product/{product_id}", data={"description": "edited"})
+    return client.patch(
+        f"/update-product/{product_id}",
+        data={"price": 99, "menu": "special", "collection_id": catalog["collections"][1]},
+        files=image_file("budgetupdate.png"),
+    )
+
+
+def update_products(client, catalog):
+    items = [
+        {"id": product_id, "price": 50 + number}
+        for number, product_id in enumerate(catalog["products"][2:])
+    ]
+    items[0]["title"] = "budgetbatch"
+    return client.patch("/update-products", json={"items": items})
+
+
+# one representative call per route with a @query_budget; the middleware runs
+# in raise mode, so going over a budget fails the request and the test
+budgeted_calls = {
+    ("GET", "/get-collection/{collection_id}"): get_collection,
+    ("GET", "/get-all-collections"): get_all_collections,
+    ("POST", "/create-collection"): create_collection,
+    ("PATCH", "/update-collection/{collection_id}"): update_collection,
+    ("DELETE", "/delete-collection/{collection_id}"): delete_collection,
+    ("GET", "/get-product/{product_id}"): get_product,
+    ("GET", "/get-products"): get_products,
+    ("POST", "/get-products"): post_get_products,
+    ("GET", "/get-all-products"): get_all_products,
+    ("GET", "/search-products"): search_products,
+    ("POST", "/create-product"): create_product,
+    ("PATCH", "/update-product/{product_id}"): update_product,
+    ("PATCH", "/update-products"): update_products,
+}
+
+
+def budgeted_routes(app):
+    return {
+        (method, route.path): route.endpoint.query_budget
+        for route in app.routes
+        if hasattr(getattr(route, "endpoint", None), "query_budget")
+        for method in route.methods
+    }
+
+
+def test_every_budgeted_route_is_exercised(client):
+    assert set(budgeted_routes(client.app)) == set(budgeted_calls)
+
+
+@pytest.mark.parametrize("route", list(budgeted_calls), ids=" ".join)
+def test_route_stays_within_budget(client, catalog, route):
+    response = budgeted_calls[route](client, catalog)
+
+    assert response.status_code < 300, response.text
+    assert "error" not in response.json()
+    assert (
+        int(response.headers["X-Query-Count"]) <= budgeted_routes(client.app)[route]
+    )
@@ -0,0 +1,9 @@
+def test_search_finds_words(client, catalog):
+    items = client.get("/search-products?q=item3").json()["items"]
+
+    assert [item["title"] for item in items] == ["item3"]
+
+
+def test_wildcards_are_matched_literally(client, catalog):
+    for query in ("%25", "_", "item_", "\\"):
+        assert client.get(f"/search-products?q={query}").json()["items"] == []
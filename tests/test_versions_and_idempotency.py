@@ -0,0 +1,206 @@
+from conftest import product_form, image_file, new_collection, collection_products
+
+
+def test_collection_if_match(client):
+    collection_id = new_collection(client, "versioned")
+    version = client.get(f"/get-collection/{collection_id}").json()["version"]
+
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "versionedone"},
+        headers={"If-Match": f'"{version}"'},
+    )
+    assert response.status_code == 202
+    assert response.json()["version"] == version + 1
+
+    # the old version is now stale, so the write is refused
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "versionedtwo"},
+        headers={"If-Match": f'"{version}"'},
+    )
+    assert response.status_code == 412
+    assert response.json()["version"] == version + 1
+    assert client.get(f"/get-collection/{collection_id}").json()["title"] == (
+        "versionedone"
+    )
+
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "versionedtwo"},
+        headers={"If-Match": "*"},
+    )
+    assert response.status_code == 202
+    assert response.json()["version"] == version + 2
+
+
+def test_etag_as_if_match(client):
+    collection_id = new_collection(client, "etagmatch")
+    etag = client.get(f"/get-collection/{collection_id}").headers["ETag"]
+
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "etagmatchone"},
+        headers={"If-Match": etag},
+    )
+    assert response.status_code == 202
+
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "etagmatchtwo"},
+        headers={"If-Match": etag},
+    )
+    assert response.status_code == 412
+
+    etag = client.get(f"/get-collection/{collection_id}").headers["ETag"]
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "etagmatchtwo"},
+        headers={"If-Match": f"W/{etag}"},
+    )
+    assert response.status_code == 400
+
+
+def test_malformed_if_match(client):
+    collection_id = new_collection(client, "badmatch")
+    response = client.patch(
+        f"/update-collection/{collection_id}",
+        data={"title": "badmatchone"},
+        headers={"If-Match": "latest"},
+    )
+
+    assert response.status_code == 400
+    assert response.json()["field"] == "If-Match"
+
+
+def test_product_if_match(client):
+    collection_id = new_collection(client, "versionproducts")
+    client.post(
+        "/create-product",
+        data=product_form("versionproduct", collection_id),
+        files=image_file("versionproduct.png"),
+    )
+    product = collection_products(client, collection_id)[0]
+
+    response = client.patch(
+        f"/update-product/{product['id']}",
+        data={"price": 70},
+        headers={"If-Match": f'"{product["version"]}"'},
+    )
+    assert response.status_code == 202
+    assert response.json()["version"] == product["version"] + 1
+
+    response = client.patch(
+        f"/update-product/{product['id']}",
+        data={"price": 80},
+        headers={"If-Match": f'"{product["version"]}"'},
+    )
+    assert response.status_code == 412
+    assert client.get(f"/get-product/{product['id']}").json()["price"] == 70
+
+    response = client.patch("/update-product/999999", data={"price": 80})
+    assert response.status_code == 404
+
+
+def test_idempotent_create_is_replayed(client):
+    headers = {"Idempotency-Key": "create-replayed"}
+
+    first = client.post("/create-collection", json={"title": "replayed"}, headers=headers)
+    second = client.post("/create-collection", json={"title": "replayed"}, headers=headers)
+
+    assert first.status_code == 200
+    assert "error" not in first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+
+
+def test_error_bodies_are_not_stored(client):
+    headers = {"Idempotency-Key": "create-after-error"}
+
+    # an unknown collection is answered with a 200 error body
+    response = client.post(
+        "/create-product",
+        data=product_form("idemproduct", 999999),
+        files=image_file("idemproduct.png"),
+        headers=headers,
+    )
+    assert "error" in response.json()
+
+    collection_id = new_collection(client, "idemcollection")
+    response = client.post(
+        "/create-product",
+        data=product_form("idemproduct", collection_id),
+        files=image_file("idemproduct.png"),
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+
+    response = client.post(
+        "/create-product",
+        data=product_form("idemproduct", collection_id),
+        files=image_file("idemproduct.png"),
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert len(collection_products(client, collection_id)) == 1
+
+
+def test_key_reused_for_another_request(client):
+    headers = {"Idempotency-Key": "reused-key"}
+    client.post("/create-collection", json={"title": "reusedkey"}, headers=headers)
+
+    response = client.post(
+        "/create-product",
+        data=product_form("reusedproduct", 1),
+        files=image_file("reusedproduct.png"),
+        headers=headers,
+    )
+
+    assert response.status_code == 400
+    assert response.json()["field"] == "Idempotency-Key"
+
+
+def test_key_reused_with_another_payload(client):
+    headers = {"Idempotency-Key": "reused-payload"}
+    client.post("/create-collection", json={"title": "payloadfirst"}, headers=headers)
+
+    response = client.post(
+        "/create-collection", json={"title": "payloadsecond"}, headers=headers
+    )
+
+    assert response.status_code == 400
+    assert response.json()["input"] == "reused-payload"
+    assert "Idempotent-Replayed" not in response.headers
+
+
+def test_form_retry_with_another_image(client):
+    collection_id = new_collection(client, "idemimages")
+    headers = {"Idempotency-Key": "reused-image"}
+    form = product_form("idemimage", collection_id)
+
+    first = client.post(
+        "/create-product", data=form, files=image_file("one.png"), headers=headers
+    )
+    retry = client.post(
+        "/create-product", data=form, files=image_file("one.png"), headers=headers
+    )
+    other = client.post(
+        "/create-product", data=form, files=image_file("two.png"), headers=headers
+    )
+
+    assert first.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert other.status_code == 400
+
+
+def test_oversized_key_is_rejected(client):
+    response = client.post(
+        "/create-collection",
+        json={"title": "longkey"},
+        headers={"Idempotency-Key": "k" * 256},
+    )
+
+    assert response.status_code == 400
+    assert response.json()["field"] == "Idempotency-Key"
@@ -0,0 +1,80 @@
+from sqlalchemy import select, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Collection, Product
+
+duplicate_collection = "we already have this collection in our DataBase"
+duplicate_product = "we already have this product in our DataBase"
+missing_collection = "we do not have this collection in our DataBase"
+
+
+def error_body(message: str, field: str, value):
+    # keep the wording pydantic produced when these checks lived in validators
+    return {"error": f"Value error, {message}", "field": field, "input": value}
+
+
+async def check_collection(db: AsyncSession, title: str = None):
+    if title is None:
+        return None
+
+    taken = await db.scalar(select(exists().where(Collection.title == title)))
+
+    if taken:
+        return error_body(duplicate_collection, "title", title)
+
+    return None
+
+
+async def check_product(
+    db: AsyncSession,
+    title: str = None,
+    collection_id: int = None,
+):
+    checks = []
+
+    if title is not None:
+        checks.append(exists().where(Product.title == title).label("title"))
+
+    if collection_id is not None:
+        checks.append(
+            exists().where(Collection.id == collection_id).label("collection_id")
+        )
+
+    if not checks:
+        return None
+
+    row = (await db.execute(select(*checks))).one()
+
+    if title is not None and row.title:
+        return error_body(duplicate_product, "title", title)
+
+    if collection_id is not None and not row.collection_id:
+        return error_body(missing_collection, "collection_id", collection_id)
+
+    return None
+
+
+async def check_products(db: AsyncSession, items: list):
+    # works out which row of a failed batch write broke a constraint
+    titles = {item.title: item.id for item in items if item.title is not None}
+    collection_ids = {
+        item.collection_id for item in items if item.collection_id is not None
+    }
+
+    if titles:
+        result = await db.execute(
+            select(Product.id, Product.title).where(Product.title.in_(titles))
+        )
+
+        for product_id, title in result:
+            if titles[title] != product_id:
+                return error_body(duplicate_product, "title", title)
+
+    if collection_ids:
+        result = await db.scalars(
+            select(Collection.id).where(Collection.id.in_(collection_ids))
+        )
+
+        for collection_id in sorted(collection_ids - set(result)):
+            return error_body(missing_collection, "collection_id", collection_id)
+
+    return None
@@ -0,0 +1,98 @@
+from concurrent.futures import ProcessPoolExecutor
+from cache import invalidate
+from dotenv import load_dotenv
+import importlib.util
+import logging
+import asyncio
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+variants_dir = "static/images/variants"
+variant_sizes = {"thumb": 200, "medium": 600}
+image_workers = int(os.getenv("IMAGE_WORKERS", "2"))
+pillow_installed = importlib.util.find_spec("PIL") is not None
+
+pool = None
+
+
+def variant_paths(image_path: str):
+    # imported products may come without an image, and so without variants
+    if not image_path:
+        return {}
+
+    name = os.path.splitext(os.path.basename(image_path))[0]
+
+    return {
+        label: f"{variants_dir}/{name}_{size}.webp"
+        for label, size in variant_sizes.items()
+    }
+
+
+def available_variants(image_path: str):
+    # a variant is only advertised once it was built; until then, or when
+    # Pillow is missing or the build failed, clients get the original image
+    return {
+        label: variant_path if os.path.exists(variant_path) else image_path
+        for label, variant_path in variant_paths(image_path).items()
+    }
+
+
+def build_variants(image_path: str):
+    from PIL import Image
+
+    os.makedirs(variants_dir, exist_ok=True)
+
+    with Image.open(image_path) as original:
+        original.load()
+
+        for label, variant_path in variant_paths(image_path).items():
+            # content-addressed names mean an existing variant is already right
+            if os.path.exists(variant_path):
+                continue
+
+            size = variant_sizes[label]
+            image = original.copy()
+            image.thumbnail((size, size))
+
+            temp_path = f"{variant_path}.{os.getpid()}.part"
+            image.save(temp_path, "WEBP", quality=80)
+            os.replace(temp_path, variant_path)
+
+
+def get_pool():
+    global pool
+
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=image_workers)
+
+    return pool
+
+
+def shutdown_pool():
+    global pool
+
+    if pool is not None:
+        # let in-flight variants finish so no half-written .part files remain
+        pool.shutdown(wait=True, cancel_futures=True)
+        pool = None
+
+
+async def generate_variants(image_path: str, *cache_keys: str):
+    if not pillow_installed:
+        logger.warning("Pillow is not installed, skipping variants for %s", image_path)
+        return
+
+    loop = asyncio.get_running_loop()
+
+    try:
+        await loop.run_in_executor(get_pool(), build_variants, image_path)
+    except Exception:
+        logger.exception("could not build variants for %s", image_path)
+        return
+
+    # payloads cached before the build still point at the original image
+    await invalidate(*cache_keys, lists=("products",))
+